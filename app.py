@@ -5,12 +5,42 @@ import numpy as np
 from PIL import Image
 import mysql.connector
 from mysql.connector import Error
+from mysql.connector.errors import InterfaceError, OperationalError, PoolError
 import pickle
 import io
+import struct
+import zlib
 from datetime import date, datetime, timedelta
 import csv
 import time
 import shutil
+import sys
+import queue
+import threading
+import atexit
+import multiprocessing
+import uuid
+import json
+import itertools
+import tempfile
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    import openpyxl
+except ImportError:  # XLSX export is optional
+    openpyxl = None
+import metrics
+from vision import (CameraRegistry, FaceDetector, FrameBroadcaster, SampleSelector,
+                    face_size_limits, run_camera_worker)
 
 app = Flask(__name__)
 app.secret_key = 'bubt_attendance_secret_key_2025'
@@ -24,27 +54,404 @@ DB_CONFIG = {
     'database': 'bubt_attendance_system'
 }
 
-# -------- CHANGED: Simple global variables with reset function --------
-# Global variables for face capture
-capture_complete = False
-captured_faces = []
-capture_in_progress = False
+# Connection pool settings (size = max open connections, timeouts in seconds)
+DB_POOL_CONFIG = {
+    'size': 8,
+    'borrow_timeout': 5.0,
+    'health_check_interval': 30.0
+}
+
+# Write-behind attendance: recognitions are coalesced per student/date/course
+# and written in one batch every flush_interval seconds. Rows are retried for
+# max_retries flushes while the database is unreachable, then dropped
+ATTENDANCE_WRITER_CONFIG = {
+    'flush_interval': 2.0,
+    'max_queue': 10000,
+    'max_retries': 150
+}
+
+# Live attendance pipeline, inside each camera's worker process: capture,
+# recognition threads and JPEG encoding connected by drop-oldest queues.
+# Detection and prediction run on all workers at once; face tracking takes frames in camera order
+PIPELINE_CONFIG = {
+    'workers': 2,
+    'queue_size': 2,
+    'jpeg_quality': 80
+}
+
+# Classroom cameras, each recognized in its own worker process. source is a device
+# index or a video file path. Attendance is recorded under the timetable slot that
+# matches the time ({'days': ['Mon', ...], 'start': 'HH:MM', 'end': 'HH:MM',
+# 'course_code': ...}), else under course_code. always_on cameras take attendance
+# from the first request on; the others only while someone watches their feed.
+CAMERAS = {
+    'room-101': {
+        'source': 0,
+        'room': 'Room 101',
+        'course_code': '',
+        'timetable': [],
+        'always_on': False
+    }
+}
+
+# Face tracking between frames: LBPH is re-run for a tracked face only every
+# repredict_interval frames, or sooner as a borderline match's distance decays
+TRACKER_CONFIG = {
+    'iou_threshold': 0.3,
+    'max_missed': 5,
+    'repredict_interval': 10,
+    'confidence_decay': 1.0,
+    'confidence_limit': 60
+}
+
+# Face detection: 'full' scans every frame at full size, 'downscale' scans a
+# resized frame, 'roi' also searches only around last frame's faces with a
+# full rescan every full_scan_interval frames
+DETECTION_CONFIG = {
+    'mode': 'roi',
+    'downscale': 0.5,
+    'roi_margin': 0.5,
+    'full_scan_interval': 15
+}
+
+# Recognizer used by the camera workers: 'lbph' runs OpenCV's predict once per face,
+# 'batch' matches all faces of a frame against the model's histograms in one NumPy pass
+# (same labels and distances, see BatchLBPHMatcher in vision.py)
+RECOGNIZER_CONFIG = {
+    'backend': 'lbph'
+}
+
+# Camera geometry used to derive min/max face size in pixels
+# (fov in degrees, distances in metres from camera to the nearest/farthest face)
+CLASSROOM_CAMERA_SETUP = {
+    'frame_width': 640,
+    'horizontal_fov': 60.0,
+    'min_distance': 0.5,
+    'max_distance': 3.0
+}
+CAPTURE_CAMERA_SETUP = {
+    'frame_width': 640,
+    'horizontal_fov': 60.0,
+    'min_distance': 0.3,
+    'max_distance': 1.5
+}
+
+# Size every stored face sample is resized to (width, height; square so order doesn't matter)
+FACE_SIZE = (200, 200)
+
+# Face sample storage: samples are kept as raw uint8 bytes, zlib compressed if enabled
+FACE_STORAGE_CONFIG = {
+    'compress': True,
+    'compress_level': 3
+}
+
+# Training data is streamed from MySQL in chunks of this many students
+TRAINING_LOADER_CONFIG = {
+    'chunk_size': 16
+}
+
+# Report exports stream rows from the database chunk_size at a time
+EXPORT_CONFIG = {
+    'chunk_size': 1000
+}
+
+# Face capture: stop at target_samples distinct samples (or after max_frames camera
+# frames); a frame is kept only if it differs from every kept sample by
+# min_difference (mean abs pixel difference of a normalised thumbnail, 0-255).
+# Each registration desk gets its own capture session and picks one of
+# camera_indexes on the form (one capture per device at a time); idle
+# sessions expire after session_timeout seconds.
+CAPTURE_CONFIG = {
+    'target_samples': 100,
+    'min_samples': 20,
+    'min_difference': 8.0,
+    'max_frames': 1500,
+    'camera_index': 0,
+    'camera_indexes': [0],
+    'max_sessions': 8,
+    'session_timeout': 600
+}
+
+# StudentImages backups are written by a thread pool, chunk_size images per task
+BACKUP_CONFIG = {
+    'workers': 4,
+    'chunk_size': 25
+}
+
+# Unknown face crops: each tracked stranger is saved at most max_per_track times,
+# min_interval seconds apart; UnknownFaces/ and unknown_faces are trimmed to
+# max_files and max_age_days every cleanup_interval seconds
+UNKNOWN_FACES_CONFIG = {
+    'min_interval': 10.0,
+    'max_per_track': 3,
+    'max_files': 5000,
+    'max_age_days': 30,
+    'cleanup_interval': 600
+}
+
+# Live attendance stream (/attendance_events): each viewer gets a queue of queue_size
+# events and a keep-alive comment every heartbeat_interval seconds. Today's rows are
+# held in memory and re-read from MySQL every refresh_interval seconds
+ATTENDANCE_EVENTS_CONFIG = {
+    'max_subscribers': 200,
+    'queue_size': 256,
+    'heartbeat_interval': 15.0,
+    'refresh_interval': 300
+}
+
+# Student counters on the dashboards are adjusted as students are saved and
+# re-counted from MySQL at most every ttl seconds
+STATS_CACHE_CONFIG = {
+    'ttl': 60
+}
+
+# ---------------- Capture Sessions ----------------
+class CaptureSession:
+    """Face capture state for one registration, keyed by an ID kept in the Flask session"""
+
+    def __init__(self, session_id, camera_index):
+        self.session_id = session_id
+        self.camera_index = camera_index
+        self.faces = []
+        self.complete = False
+        self.in_progress = False
+        self.last_active = time.time()
+
+    def reset(self):
+        self.faces = []
+        self.complete = False
+        self.in_progress = False
+        self.touch()
+
+    def touch(self):
+        self.last_active = time.time()
+
+
+capture_sessions = {}
+capture_sessions_lock = threading.Lock()
+
+def expire_capture_sessions():
+    """Drop capture sessions idle for longer than the session timeout"""
+    cutoff = time.time() - CAPTURE_CONFIG['session_timeout']
+    with capture_sessions_lock:
+        for session_id, capture in list(capture_sessions.items()):
+            if capture.last_active < cutoff:
+                capture.in_progress = False
+                del capture_sessions[session_id]
+                print(f"✓ Expired idle capture session {session_id}")
+
+def create_capture_session(camera_index):
+    """Start a new capture session; None when too many registrations are active"""
+    expire_capture_sessions()
+    with capture_sessions_lock:
+        if len(capture_sessions) >= CAPTURE_CONFIG['max_sessions']:
+            return None
+        capture = CaptureSession(uuid.uuid4().hex, camera_index)
+        capture_sessions[capture.session_id] = capture
+    return capture
+
+def claim_capture_camera(capture):
+    """Start capturing unless another session is already capturing from the same camera"""
+    with capture_sessions_lock:
+        for other in capture_sessions.values():
+            if other is not capture and other.in_progress and other.camera_index == capture.camera_index:
+                return False
+        capture.reset()
+        capture.in_progress = True
+    return True
+
+def get_capture_session(session_id):
+    """Look up a live capture session, refreshing its idle timer"""
+    expire_capture_sessions()
+    capture = capture_sessions.get(session_id) if session_id else None
+    if capture:
+        capture.touch()
+    return capture
+
+def discard_capture_session(session_id):
+    with capture_sessions_lock:
+        capture = capture_sessions.pop(session_id, None)
+    if capture:
+        capture.in_progress = False
+
+# ---------------- Metrics ----------------
+# Camera hot-path metrics are defined in vision.py and reported by each camera worker
+DB_CALL_SECONDS = metrics.histogram('attendance_db_call_seconds', "Database call latency, by function", ['call'])
+DB_POOL_WAIT_SECONDS = metrics.histogram('attendance_db_pool_wait_seconds', "Time spent waiting for a pooled connection")
+DB_CONNECTION_ERRORS = metrics.counter('attendance_db_connection_errors_total',
+                                       "Failed attempts to open or borrow a database connection")
+ATTENDANCE_WRITES = metrics.counter('attendance_rows_written_total', "Attendance rows written by the attendance writer")
+ATTENDANCE_WRITE_FAILURES = metrics.counter('attendance_write_failures_total', "Attendance batches that failed to write")
+MODEL_STUDENTS = metrics.gauge('attendance_model_students', "Students in the active recognition model")
+MODEL_SAMPLES = metrics.gauge('attendance_model_samples', "Face samples in the active recognition model")
+
+def timed_db_call(func):
+    """Record the wall time of a database helper in DB_CALL_SECONDS"""
+    histogram = DB_CALL_SECONDS.labels(func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+    return wrapper
+
+# ---------------- Connection Pool ----------------
+class PooledConnection:
+    """Borrowed pool connection; close() hands it back to the pool"""
+
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+
+    def close(self):
+        if self._connection is not None:
+            self._pool.release(self._connection)
+            self._connection = None
 
-def reset_capture_globals():
-    """Reset global capture variables"""
-    global capture_complete, captured_faces, capture_in_progress
-    capture_complete = False
-    captured_faces = []
-    capture_in_progress = False
-    print("✓ Capture globals reset")
+    def discard(self):
+        """Close the real connection instead of reusing it (e.g. unread rows are pending)"""
+        if self._connection is not None:
+            self._pool._discard(self._connection)
+            self._connection = None
+
+    def __getattr__(self, name):
+        if self._connection is None:
+            raise PoolError("Connection already returned to the pool")
+        return getattr(self._connection, name)
+
+
+class ConnectionPool:
+    """Bounded MySQL connection pool with borrow timeouts and health checks"""
+
+    def __init__(self, config, size=8, borrow_timeout=5.0, health_check_interval=30.0):
+        self.config = config
+        self.size = size
+        self.borrow_timeout = borrow_timeout
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self.stats = {
+            'borrows': 0,
+            'borrow_wait_total': 0.0,
+            'borrow_wait_max': 0.0,
+            'timeouts': 0,
+            'connection_errors': 0,
+            'health_check_failures': 0
+        }
+
+    def _open(self):
+        """Open a new server connection, counting it against the pool size"""
+        try:
+            return mysql.connector.connect(**self.config)
+        except Error:
+            with self._lock:
+                self._opened -= 1
+                self.stats['connection_errors'] += 1
+            DB_CONNECTION_ERRORS.inc()
+            raise
+
+    def _discard(self, connection):
+        with self._lock:
+            self._opened -= 1
+        try:
+            connection.close()
+        except Error:
+            pass
+
+    def _is_healthy(self, connection, idle_since):
+        """Ping connections that sat idle longer than the check interval"""
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            connection.ping(reconnect=True, attempts=1, delay=0)
+            return True
+        except Error:
+            with self._lock:
+                self.stats['health_check_failures'] += 1
+            return False
+
+    def acquire(self):
+        """Borrow a connection, waiting up to borrow_timeout for a free slot"""
+        started = time.monotonic()
+        deadline = started + self.borrow_timeout
+
+        while True:
+            try:
+                connection, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_open = self._opened < self.size
+                    if can_open:
+                        self._opened += 1
+
+                if can_open:
+                    connection, idle_since = self._open(), time.monotonic()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        with self._lock:
+                            self.stats['timeouts'] += 1
+                        DB_CONNECTION_ERRORS.inc()
+                        raise PoolError(f"No free database connection after {self.borrow_timeout}s")
+                    try:
+                        connection, idle_since = self._idle.get(timeout=remaining)
+                    except queue.Empty:
+                        continue
+
+            if not self._is_healthy(connection, idle_since):
+                self._discard(connection)
+                continue
+
+            waited = time.monotonic() - started
+            DB_POOL_WAIT_SECONDS.observe(waited)
+            with self._lock:
+                self.stats['borrows'] += 1
+                self.stats['borrow_wait_total'] += waited
+                self.stats['borrow_wait_max'] = max(self.stats['borrow_wait_max'], waited)
+            return PooledConnection(self, connection)
+
+    def release(self, connection):
+        """Return a connection, ending any open transaction so no stale snapshot leaks"""
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except Error:
+            self._discard(connection)
+            return
+        self._idle.put((connection, time.monotonic()))
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['open'] = self._opened
+        stats['idle'] = self._idle.qsize()
+        stats['in_use'] = stats['open'] - stats['idle']
+        stats['size'] = self.size
+        stats['borrow_wait_avg'] = stats['borrow_wait_total'] / stats['borrows'] if stats['borrows'] else 0.0
+        return stats
+
+
+db_pool = None
+db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    """Create the pool on first use (the database must exist first)"""
+    global db_pool
+    if db_pool is None:
+        with db_pool_lock:
+            if db_pool is None:
+                db_pool = ConnectionPool(DB_CONFIG, **DB_POOL_CONFIG)
+    return db_pool
 
 # ---------------- Database Functions ----------------
 def create_connection():
-    """Create database connection"""
+    """Borrow a database connection from the pool"""
     try:
-        connection = mysql.connector.connect(**DB_CONFIG)
-        if connection.is_connected():
-            return connection
+        return get_db_pool().acquire()
     except Error as e:
         print(f"Error connecting to MySQL: {e}")
         return None
@@ -69,13 +476,22 @@ def initialize_database():
                 department VARCHAR(50),
                 semester VARCHAR(20),
                 section VARCHAR(10),
-                face_data LONGBLOB,
                 is_trained BOOLEAN DEFAULT FALSE,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
             )
         """)
         
+        # Face samples live in their own table so reads of students never touch the blobs
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS student_faces (
+                student_id VARCHAR(20) PRIMARY KEY,
+                face_data LONGBLOB NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                FOREIGN KEY (student_id) REFERENCES students(student_id) ON DELETE CASCADE
+            )
+        """)
+        
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS attendance (
                 attendance_id INT AUTO_INCREMENT PRIMARY KEY,
@@ -91,6 +507,20 @@ def initialize_database():
             )
         """)
         
+        # One row per student, day and course, kept in step with attendance by every write;
+        # range reports aggregate this instead of raw attendance rows
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS attendance_daily (
+                student_id VARCHAR(20) NOT NULL,
+                date DATE NOT NULL,
+                course_code VARCHAR(20) NOT NULL DEFAULT '',
+                in_time TIME NOT NULL,
+                out_time TIME NOT NULL,
+                PRIMARY KEY (date, course_code, student_id),
+                KEY idx_daily_student (student_id, date, course_code)
+            )
+        """)
+        
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS unknown_faces (
                 id INT AUTO_INCREMENT PRIMARY KEY,
@@ -109,6 +539,8 @@ def initialize_database():
             )
         """)
         
+        migrate_schema(cursor)
+        
         connection.commit()
         cursor.close()
         connection.close()
@@ -118,344 +550,1969 @@ def initialize_database():
         print(f"Error initializing database: {e}")
         return False
 
+# Secondary indexes: (table, name, columns)
+SCHEMA_INDEXES = [
+    # Today's list: WHERE date = ? ORDER BY time
+    ('attendance', 'idx_attendance_date_time', '(date, time)'),
+    # Daily report: WHERE date = ? GROUP BY student_id, covering MIN(timestamp)/MAX(time)
+    ('attendance', 'idx_attendance_date_student', '(date, student_id, time, timestamp)'),
+    # Unknown face retention sweep
+    ('unknown_faces', 'idx_unknown_faces_detected', '(detected_at)')
+]
+
+def migrate_schema(cursor):
+    """Bring an existing database up to the current schema; safe to run on every start"""
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = 'students' AND column_name = 'face_data'
+    """)
+    if cursor.fetchone()[0]:
+        # Move blobs out of the students row (older installs stored them inline)
+        cursor.execute("""
+            INSERT IGNORE INTO student_faces (student_id, face_data, updated_at)
+            SELECT student_id, face_data, updated_at FROM students WHERE face_data IS NOT NULL
+        """)
+        moved = cursor.rowcount
+        # ALTER copies rows without firing ON UPDATE, so updated_at (the model manifest's version) survives
+        cursor.execute("ALTER TABLE students DROP COLUMN face_data")
+        print(f"✓ Moved face data for {moved} students to student_faces")
+    
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM attendance_daily)")
+    if not cursor.fetchone()[0]:
+        # Build the daily summary from attendance recorded before it existed
+        cursor.execute("""
+            INSERT IGNORE INTO attendance_daily (student_id, date, course_code, in_time, out_time)
+            SELECT student_id, date, COALESCE(course_code, ''), MIN(TIME(timestamp)), MAX(time)
+            FROM attendance
+            GROUP BY student_id, date, COALESCE(course_code, '')
+        """)
+        if cursor.rowcount:
+            print(f"✓ Built daily attendance summary ({cursor.rowcount} rows)")
+    
+    cursor.execute("""
+        SELECT table_name, index_name FROM information_schema.statistics
+        WHERE table_schema = DATABASE()
+    """)
+    existing = {(table.lower(), index) for table, index in cursor.fetchall()}
+    for table, index, columns in SCHEMA_INDEXES:
+        if (table, index) not in existing:
+            cursor.execute(f"CREATE INDEX {index} ON {table} {columns}")
+            print(f"✓ Created index {index} on {table}")
+
+# Hot queries whose plans /db_diagnostics reports; %(date)s is filled with today's date
+# and %(header_size)s with FACE_DATA_HEADER.size, as in get_face_data_headers
+DIAGNOSTIC_QUERIES = {
+    'today_attendance': """
+        SELECT student_id, student_name, department, time, course_code
+        FROM attendance WHERE date = %(date)s ORDER BY time DESC
+    """,
+    'daily_report': """
+        SELECT s.student_id, s.name, s.department, T.in_time_dt, T.out_time_col
+        FROM students s
+        LEFT JOIN (
+            SELECT student_id, MIN(timestamp) AS in_time_dt, MAX(time) AS out_time_col
+            FROM attendance WHERE date = %(date)s GROUP BY student_id
+        ) AS T ON s.student_id = T.student_id
+        ORDER BY s.student_id ASC
+    """,
+    'range_report': """
+        SELECT s.student_id, COUNT(DISTINCT d.date)
+        FROM students s
+        LEFT JOIN attendance_daily d
+            ON d.student_id = s.student_id AND d.date BETWEEN %(date)s - INTERVAL 120 DAY AND %(date)s
+        GROUP BY s.student_id
+    """,
+    'student_counts': "SELECT COUNT(*), COALESCE(SUM(is_trained), 0) FROM students",
+    'face_data_headers': "SELECT student_id, SUBSTRING(face_data, 1, %(header_size)s) FROM student_faces ORDER BY student_id",
+    'unknown_faces_retention': "SELECT id FROM unknown_faces WHERE detected_at < %(date)s"
+}
+
+def explain_queries():
+    """EXPLAIN each diagnostic query plus the table sizes and indexes, or None if the DB is down"""
+    connection = create_connection()
+    if not connection:
+        return None
+    try:
+        cursor = connection.cursor(dictionary=True)
+        plans = {}
+        for name, query in DIAGNOSTIC_QUERIES.items():
+            try:
+                cursor.execute("EXPLAIN " + query, {'date': date.today(), 'header_size': FACE_DATA_HEADER.size})
+                plans[name] = cursor.fetchall()
+            except Error as e:
+                plans[name] = {'error': str(e)}
+        
+        cursor.execute("""
+            SELECT table_name AS `table`, table_rows AS `rows`,
+                   data_length AS data_bytes, index_length AS index_bytes
+            FROM information_schema.tables WHERE table_schema = DATABASE()
+        """)
+        tables = cursor.fetchall()
+        cursor.execute("""
+            SELECT table_name AS `table`, index_name AS `index`,
+                   GROUP_CONCAT(column_name ORDER BY seq_in_index) AS `columns`
+            FROM information_schema.statistics WHERE table_schema = DATABASE()
+            GROUP BY table_name, index_name
+        """)
+        indexes = cursor.fetchall()
+        cursor.close()
+        return {'plans': plans, 'tables': tables, 'indexes': indexes}
+    except Error as e:
+        print(f"Error collecting query plans: {e}")
+        return None
+    finally:
+        connection.close()
+
 def insert_student(student_id, name, department="CSE", semester="", section=""):
     """Insert new student into database"""
+    connection = create_connection()
+    if not connection:
+        return False
     try:
-        connection = create_connection()
-        if connection:
-            cursor = connection.cursor()
-            query = """
-                INSERT INTO students (student_id, name, department, semester, section) 
-                VALUES (%s, %s, %s, %s, %s)
-            """
-            cursor.execute(query, (student_id, name, department, semester, section))
-            connection.commit()
-            cursor.close()
-            connection.close()
-            return True
+        cursor = connection.cursor()
+        query = """
+            INSERT INTO students (student_id, name, department, semester, section) 
+            VALUES (%s, %s, %s, %s, %s)
+        """
+        cursor.execute(query, (student_id, name, department, semester, section))
+        connection.commit()
+        cursor.close()
+        return True
     except Error as e:
         print(f"Error inserting student: {e}")
         return False
+    finally:
+        connection.close()
+
+# Face samples are stored as one contiguous uint8 block behind a small header:
+# magic, flags, sample count, height, width. Rows without the magic are legacy pickles.
+FACE_DATA_MAGIC = b'BFD1'
+FACE_DATA_HEADER = struct.Struct('<4sBIHH')
+FACE_DATA_ZLIB = 1
+
+def encode_face_samples(face_images):
+    """Pack equally sized grayscale face images into the compact storage format"""
+    samples = np.ascontiguousarray(np.stack(face_images), dtype=np.uint8)
+    count, height, width = samples.shape
+    payload = samples.tobytes()
+    flags = 0
+    if FACE_STORAGE_CONFIG['compress']:
+        payload = zlib.compress(payload, FACE_STORAGE_CONFIG['compress_level'])
+        flags |= FACE_DATA_ZLIB
+    return FACE_DATA_HEADER.pack(FACE_DATA_MAGIC, flags, count, height, width) + payload
+
+def read_face_data_header(blob):
+    """Return (flags, count, height, width), or None for legacy pickled rows"""
+    if len(blob) < FACE_DATA_HEADER.size or bytes(blob[:4]) != FACE_DATA_MAGIC:
+        return None
+    return FACE_DATA_HEADER.unpack_from(blob)[1:]
 
-def save_face_data(student_id, face_images, labels):
+def decode_face_samples(blob, out=None):
+    """Decode a face_data blob into a (count, height, width) uint8 array.
+
+    Uncompressed blobs are viewed in place with np.frombuffer; if `out`
+    is given the samples are copied straight into it (e.g. a slice of a
+    preallocated training matrix) and it is returned.
+    """
+    header = read_face_data_header(blob)
+    if header is None:
+        samples = np.stack(pickle.loads(blob)['images']).astype(np.uint8, copy=False)
+    else:
+        flags, count, height, width = header
+        payload = memoryview(blob)[FACE_DATA_HEADER.size:]
+        if flags & FACE_DATA_ZLIB:
+            payload = zlib.decompress(payload)
+        samples = np.frombuffer(payload, dtype=np.uint8).reshape(count, height, width)
+    if out is None:
+        return samples
+    out[...] = samples
+    return out
+
+def count_face_samples(blob):
+    """Number of samples in a face_data blob, reading only the header when possible"""
+    header = read_face_data_header(blob)
+    if header is None:
+        return len(pickle.loads(blob)['images'])
+    return header[1]
+
+@timed_db_call
+def save_face_data(student_id, face_images):
     """Save individual student's face training data to database"""
+    connection = create_connection()
+    if not connection:
+        return False
     try:
-        connection = create_connection()
-        if connection:
-            cursor = connection.cursor()
-            
-            face_data = {
-                'images': face_images,
-                'labels': labels
-            }
-            serialized_data = pickle.dumps(face_data)
-            
-            query = """
-                UPDATE students 
-                SET face_data = %s, is_trained = TRUE, updated_at = CURRENT_TIMESTAMP
-                WHERE student_id = %s
-            """
-            cursor.execute(query, (serialized_data, student_id))
-            connection.commit()
-            cursor.close()
-            connection.close()
-            return True
+        cursor = connection.cursor()
+        
+        serialized_data = encode_face_samples(face_images)
+        
+        cursor.execute("""
+            INSERT INTO student_faces (student_id, face_data) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE face_data = VALUES(face_data)
+        """, (student_id, serialized_data))
+        # students.updated_at is the version the model manifest compares against
+        query = """
+            UPDATE students 
+            SET is_trained = TRUE, updated_at = CURRENT_TIMESTAMP
+            WHERE student_id = %s
+        """
+        cursor.execute(query, (student_id,))
+        connection.commit()
+        cursor.close()
+        return True
     except Error as e:
         print(f"Error saving face data: {e}")
         return False
+    finally:
+        connection.close()
 
-def get_all_face_data():
+def migrate_face_data():
+    """Rewrite legacy pickled face_data rows in the compact format, one student at a time"""
+    connection = create_connection()
+    if not connection:
+        return None
+    migrated = 0
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT student_id FROM student_faces WHERE LEFT(face_data, 4) <> %s",
+            (FACE_DATA_MAGIC,)
+        )
+        student_ids = [row[0] for row in cursor.fetchall()]
+        
+        for student_id in student_ids:
+            cursor.execute("SELECT face_data FROM student_faces WHERE student_id = %s", (student_id,))
+            row = cursor.fetchone()
+            if not row or not row[0] or read_face_data_header(row[0]) is not None:
+                continue
+            blob = encode_face_samples(decode_face_samples(row[0]))
+            # students.updated_at is untouched, so the model manifest doesn't see a changed student
+            cursor.execute(
+                "UPDATE student_faces SET face_data = %s WHERE student_id = %s",
+                (blob, student_id)
+            )
+            connection.commit()
+            migrated += 1
+        cursor.close()
+        print(f"✓ Migrated face data for {migrated} students")
+        return migrated
+    except Error as e:
+        print(f"Error migrating face data: {e}")
+        return None
+    finally:
+        connection.close()
+
+def get_all_face_data(progress=None):
     """Retrieve all trained face data from database"""
+    return get_face_data_for_students(progress=progress)
+
+def get_face_data_for_students(student_ids=None, first_label=0, progress=None):
+    """Retrieve trained face data, optionally only for some students.
+
+    Labels are handed out in student_id order starting at first_label, so
+    new students can be appended to an existing model's label space.
+    A first pass reads only the blob headers to size one training matrix;
+    a second pass streams the blobs through an unbuffered cursor in
+    chunks, decoding each student into its slice and dropping the blob,
+    so raw blobs for all students are never held at once.
+    progress(phase, **counts) is called as rows are loaded and decoded.
+    """
+    if progress is None:
+        progress = lambda phase, **counts: None
+    if student_ids is not None and not student_ids:
+        return [], [], {}
+    
+    where = ""
+    params = ()
+    if student_ids is not None:
+        placeholders = ", ".join(["%s"] * len(student_ids))
+        where = f"WHERE student_id IN ({placeholders})"
+        params = tuple(student_ids)
+    
+    progress('loading', peak_rss_mb=get_peak_rss_mb())
+    headers = get_face_data_headers(where, params)
+    if headers is None:
+        return [], [], {}
+    if any(header is None for header in headers.values()):
+        # Legacy pickled rows carry no sample count; convert them so they can be streamed
+        migrate_face_data()
+        headers = get_face_data_headers(where, params)
+        if headers is None:
+            return [], [], {}
+    
+    # Reserve a slice of the training matrix for every student up front
+    slices = {}
+    total = 0
+    for idx, (student_id, header) in enumerate(headers.items(), start=first_label):
+        if header is None or (header[2], header[3]) != FACE_SIZE[::-1]:
+            print(f"Skipping face data for {student_id}: unreadable or wrong sample size")
+            continue
+        slices[student_id] = (idx, total, header[1])
+        total += header[1]
+    
+    all_faces = np.empty((total,) + FACE_SIZE[::-1], dtype=np.uint8)
+    all_labels = np.empty(total, dtype=np.int32)
+    student_id_map = {}
+    progress('decoding', total_students=len(slices), students=0, samples=0, peak_rss_mb=get_peak_rss_mb())
+    
+    connection = create_connection()
+    if not connection:
+        return [], [], {}
     try:
-        connection = create_connection()
-        if connection:
-            cursor = connection.cursor()
-            query = """
-                SELECT student_id, face_data 
-                FROM students 
-                WHERE is_trained = TRUE AND face_data IS NOT NULL
-            """
-            cursor.execute(query)
-            results = cursor.fetchall()
-            cursor.close()
-            connection.close()
-            
-            all_faces = []
-            all_labels = []
-            student_id_map = {}
-            
-            for idx, (student_id, face_data_blob) in enumerate(results):
-                if face_data_blob:
-                    face_data = pickle.loads(face_data_blob)
-                    all_faces.extend(face_data['images'])
-                    if student_id not in student_id_map:
-                        student_id_map[student_id] = idx
-                    all_labels.extend([idx] * len(face_data['images']))
-            
-            return all_faces, all_labels, student_id_map
+        cursor = connection.cursor(buffered=False)
+        cursor.execute(f"SELECT student_id, face_data FROM student_faces {where} ORDER BY student_id", params)
+        decoded = 0
+        while True:
+            rows = cursor.fetchmany(TRAINING_LOADER_CONFIG['chunk_size'])
+            if not rows:
+                break
+            for student_id, face_data_blob in rows:
+                reserved = slices.get(student_id)
+                # Students added or re-captured since the header pass are left for the next run
+                if reserved is None or count_face_samples(face_data_blob) != reserved[2]:
+                    continue
+                label, offset, count = reserved
+                decode_face_samples(face_data_blob, out=all_faces[offset:offset + count])
+                all_labels[offset:offset + count] = label
+                student_id_map[student_id] = label
+                decoded += count
+            del rows
+            progress('decoding', students=len(student_id_map), samples=decoded, peak_rss_mb=get_peak_rss_mb())
+        cursor.close()
     except Error as e:
         print(f"Error retrieving face data: {e}")
         return [], [], {}
+    finally:
+        connection.close()
+    
+    if decoded < total:
+        # Drop slices of students that changed mid-load
+        keep = np.zeros(total, dtype=bool)
+        for student_id in student_id_map:
+            _, offset, count = slices[student_id]
+            keep[offset:offset + count] = True
+        all_faces, all_labels = all_faces[keep], all_labels[keep]
+    
+    # LBPH takes a list of images; these are views into the matrix, not copies
+    return list(all_faces), all_labels, student_id_map
+
+def get_face_data_headers(where, params):
+    """Read just the storage header of each matching student's face data, in student_id order"""
+    connection = create_connection()
+    if not connection:
+        return None
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            f"SELECT student_id, SUBSTRING(face_data, 1, %s) FROM student_faces {where} ORDER BY student_id",
+            (FACE_DATA_HEADER.size,) + params
+        )
+        results = cursor.fetchall()
+        cursor.close()
+        return {student_id: read_face_data_header(prefix) for student_id, prefix in results}
+    except Error as e:
+        print(f"Error reading face data headers: {e}")
+        return None
+    finally:
+        connection.close()
 
+def get_peak_rss_mb():
+    """Peak resident memory of this process in MB, or None if it can't be measured"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is KB on Linux, bytes on macOS
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / (1024 * 1024), 1)
+    return None
+
+@timed_db_call
+def get_trained_student_versions():
+    """Map every student with face data to its last update time"""
+    connection = create_connection()
+    if not connection:
+        return {}
+    try:
+        cursor = connection.cursor()
+        query = """
+            SELECT s.student_id, s.updated_at 
+            FROM students s
+            JOIN student_faces f ON f.student_id = s.student_id
+            WHERE s.is_trained = TRUE
+        """
+        cursor.execute(query)
+        results = cursor.fetchall()
+        cursor.close()
+        return dict(results)
+    except Error as e:
+        print(f"Error fetching trained students: {e}")
+        return {}
+    finally:
+        connection.close()
+
+@timed_db_call
 def get_student_name(student_id):
     """Get student name by ID"""
+    connection = create_connection()
+    if not connection:
+        return None, None
     try:
-        connection = create_connection()
-        if connection:
-            cursor = connection.cursor()
-            query = "SELECT name, department FROM students WHERE student_id = %s"
-            cursor.execute(query, (student_id,))
-            result = cursor.fetchone()
-            cursor.close()
-            connection.close()
-            return result if result else (None, None)
+        cursor = connection.cursor()
+        query = "SELECT name, department FROM students WHERE student_id = %s"
+        cursor.execute(query, (student_id,))
+        result = cursor.fetchone()
+        cursor.close()
+        return result if result else (None, None)
     except Error as e:
         print(f"Error fetching student: {e}")
         return None, None
+    finally:
+        connection.close()
 
-def get_trained_students_count():
-    """Get count of trained students"""
+@timed_db_call
+def get_student_directory(student_ids):
+    """Fetch (name, department) for many students in one query"""
+    if not student_ids:
+        return {}
+    connection = create_connection()
+    if not connection:
+        return {}
     try:
-        connection = create_connection()
-        if connection:
-            cursor = connection.cursor()
-            query = "SELECT COUNT(*) FROM students WHERE is_trained = TRUE"
-            cursor.execute(query)
-            result = cursor.fetchone()
-            cursor.close()
+        cursor = connection.cursor()
+        placeholders = ", ".join(["%s"] * len(student_ids))
+        query = f"SELECT student_id, name, department FROM students WHERE student_id IN ({placeholders})"
+        cursor.execute(query, tuple(student_ids))
+        results = cursor.fetchall()
+        cursor.close()
+        return {student_id: (name, department) for student_id, name, department in results}
+    except Error as e:
+        print(f"Error fetching student directory: {e}")
+        return {}
+    finally:
+        connection.close()
+
+@timed_db_call
+def get_student_counts():
+    """Total and trained student counts in one pass, or None on error"""
+    connection = create_connection()
+    if not connection:
+        return None
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(is_trained), 0) FROM students")
+        total, trained = cursor.fetchone()
+        cursor.close()
+        return {'total_students': int(total), 'trained_count': int(trained)}
+    except Error as e:
+        print(f"Error getting student counts: {e}")
+        return None
+    finally:
+        connection.close()
+
+# Keeps attendance_daily in step with attendance; run in the same transaction
+DAILY_SUMMARY_UPSERT = """
+    INSERT INTO attendance_daily (student_id, date, course_code, in_time, out_time)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE in_time = LEAST(in_time, VALUES(in_time)),
+                            out_time = GREATEST(out_time, VALUES(out_time))
+"""
+
+# MySQL lock wait timeout and deadlock: the same rows can succeed on retry
+TRANSIENT_DB_ERRNOS = (1205, 1213)
+
+def is_transient_db_error(error):
+    """True for connection, pool and lock errors, which a retry can get past (unlike bad rows)"""
+    return (isinstance(error, (PoolError, InterfaceError, OperationalError))
+            or getattr(error, 'errno', None) in TRANSIENT_DB_ERRNOS)
+
+@timed_db_call
+def insert_attendance_batch(records, raise_errors=False):
+    """Insert/update many attendance rows with a single executemany.
+
+    Each record is (student_id, name, department, course_code, first_seen, last_seen).
+    `timestamp` (the in time) only ever moves back to an earlier first_seen,
+    and `time` (the out time) only ever moves forward. With raise_errors the database
+    error is raised instead of returning False.
+    """
+    if not records:
+        return True
+    connection = create_connection()
+    if not connection:
+        if raise_errors:
+            raise PoolError("Could not connect to database")
+        return False
+    try:
+        cursor = connection.cursor()
+        query = """
+            INSERT INTO attendance (student_id, student_name, department, course_code, date, time, timestamp) 
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE time = GREATEST(time, VALUES(time)),
+                                    timestamp = LEAST(timestamp, VALUES(timestamp))
+        """
+        rows = [
+            (student_id, name, department, course_code,
+             last_seen.strftime('%Y-%m-%d'), last_seen.strftime('%H:%M:%S'),
+             first_seen.strftime('%Y-%m-%d %H:%M:%S'))
+            for student_id, name, department, course_code, first_seen, last_seen in records
+        ]
+        cursor.executemany(query, rows)
+        cursor.executemany(DAILY_SUMMARY_UPSERT, [
+            (student_id, last_seen.strftime('%Y-%m-%d'), course_code or "",
+             first_seen.strftime('%H:%M:%S'), last_seen.strftime('%H:%M:%S'))
+            for student_id, _, _, course_code, first_seen, last_seen in records
+        ])
+        connection.commit()
+        cursor.close()
+        return True
+    except Error as e:
+        if raise_errors:
+            raise
+        print(f"Error inserting attendance batch: {e}")
+        return False
+    finally:
+        connection.close()
+
+def format_time_value(time_val):
+    """Format a MySQL TIME value (timedelta or time) as HH:MM:SS"""
+    if isinstance(time_val, timedelta):
+        total_seconds = int(time_val.total_seconds())
+        hours = total_seconds // 3600
+        minutes = (total_seconds % 3600) // 60
+        seconds = total_seconds % 60
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    return str(time_val)
+
+@timed_db_call
+def get_today_attendance(include_course=False):
+    """Get today's attendance records with properly formatted time"""
+    connection = create_connection()
+    if not connection:
+        return []
+    try:
+        cursor = connection.cursor()
+        today = date.today()
+        query = """
+            SELECT student_id, student_name, department, time, course_code
+            FROM attendance 
+            WHERE date = %s
+            ORDER BY time DESC
+        """
+        cursor.execute(query, (today,))
+        results = cursor.fetchall()
+        cursor.close()
+    except Error as e:
+        print(f"Error fetching attendance: {e}")
+        return []
+    finally:
+        connection.close()
+    
+    # Format time properly
+    formatted_results = []
+    for record in results:
+        student_id, name, dept, time_val, course_code = record
+        formatted_time = format_time_value(time_val) if time_val else "00:00:00"
+        if include_course:
+            formatted_results.append((student_id, name, dept, formatted_time, course_code or ""))
+        else:
+            formatted_results.append((student_id, name, dept, formatted_time))
+    
+    return formatted_results
+
+def get_all_students():
+    """Get all registered students"""
+    connection = create_connection()
+    if not connection:
+        return []
+    try:
+        cursor = connection.cursor()
+        query = "SELECT student_id, name, department, is_trained FROM students ORDER BY created_at DESC"
+        cursor.execute(query)
+        results = cursor.fetchall()
+        cursor.close()
+        return results
+    except Error as e:
+        print(f"Error fetching students: {e}")
+        return []
+    finally:
+        connection.close()
+
+@timed_db_call
+def log_unknown_faces_batch(records):
+    """Log many unknown face detections, each (image_path, detected_at), in one statement"""
+    if not records:
+        return True
+    connection = create_connection()
+    if not connection:
+        return False
+    try:
+        cursor = connection.cursor()
+        query = "INSERT INTO unknown_faces (image_path, detected_at) VALUES (%s, %s)"
+        cursor.executemany(query, records)
+        connection.commit()
+        cursor.close()
+        return True
+    except Error as e:
+        print(f"Error logging unknown faces: {e}")
+        return False
+    finally:
+        connection.close()
+
+def delete_unknown_face_logs(older_than=None, image_paths=()):
+    """Remove unknown_faces rows by age and/or image path"""
+    connection = create_connection()
+    if not connection:
+        return False
+    try:
+        cursor = connection.cursor()
+        if older_than is not None:
+            cursor.execute("DELETE FROM unknown_faces WHERE detected_at < %s", (older_than,))
+        if image_paths:
+            cursor.executemany("DELETE FROM unknown_faces WHERE image_path = %s",
+                               [(path,) for path in image_paths])
+        connection.commit()
+        cursor.close()
+        return True
+    except Error as e:
+        print(f"Error deleting unknown face logs: {e}")
+        return False
+    finally:
+        connection.close()
+
+# All students LEFT JOIN their grouped attendance times for one date
+ATTENDANCE_SUMMARY_QUERY = """
+    SELECT 
+        student_id, 
+        MIN(timestamp) AS in_time_dt,
+        MAX(time) AS out_time_col
+    FROM attendance
+    WHERE date = %s
+    GROUP BY student_id
+"""
+
+DAILY_REPORT_QUERY = """
+    SELECT 
+        s.student_id, 
+        s.name, 
+        s.department,
+        T.in_time_dt,
+        T.out_time_col
+    FROM students s
+    LEFT JOIN ({}) AS T
+    ON s.student_id = T.student_id
+    ORDER BY s.student_id ASC
+""".format(ATTENDANCE_SUMMARY_QUERY)
+
+@timed_db_call
+def get_full_report_by_date(selected_date):
+    """
+    Get a full report: all students LEFT JOIN grouped attendance times for the selected date.
+    """
+    connection = create_connection()
+    if not connection:
+        return []
+    try:
+        cursor = connection.cursor()
+        cursor.execute(DAILY_REPORT_QUERY, (selected_date,))
+        results = cursor.fetchall()
+        cursor.close()
+    except Error as e:
+        print(f"Error fetching full attendance report: {e}")
+        return []
+    finally:
+        connection.close()
+
+    return [format_report_row(row) for row in results]
+
+def format_report_row(row):
+    """Turn a (student_id, name, dept, in_time_dt, out_time_col) report row into display values"""
+    student_id, name, dept, in_time_dt, out_time_col = row
+    
+    status = "Present" if in_time_dt or out_time_col else "Absent"
+    
+    # Format in_time (datetime object)
+    in_time_display = in_time_dt.strftime('%H:%M:%S') if in_time_dt else "-"
+    
+    # Format out_time (could be timedelta or time object)
+    out_time_display = format_time_value(out_time_col) if out_time_col else "-"
+
+    return {
+        'id': student_id,
+        'name': name,
+        'department': dept,
+        'in_time': in_time_display,
+        'out_time': out_time_display,
+        'status': status
+    }
+
+def stream_query_rows(query, params=(), chunk_size=None):
+    """Yield lists of rows from an unbuffered cursor, chunk_size rows at a time.
+
+    The connection stays borrowed until the generator is exhausted; one that is
+    abandoned part way (e.g. the client went away) still has unread rows, so it
+    is closed rather than handed back to the pool.
+    """
+    chunk_size = chunk_size or EXPORT_CONFIG['chunk_size']
+    connection = create_connection()
+    if not connection:
+        raise Error("Could not connect to database")
+    finished = False
+    try:
+        cursor = connection.cursor(buffered=False)
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+        cursor.close()
+        finished = True
+    finally:
+        if finished:
             connection.close()
-            return result[0] if result else 0
+        else:
+            connection.discard()
+
+@timed_db_call
+def get_attendance_range_report(start_date, end_date, course_code=None, department=None):
+    """Per-student presence between two dates from the daily summary.
+
+    A class day is a date on which anyone attended (the selected course and
+    any student of the selected department, if given); percentage is the
+    share of class days a student was present.
+    Returns (class_days, rows) or (0, None) on error.
+    """
+    connection = create_connection()
+    if not connection:
+        return 0, None
+    try:
+        cursor = connection.cursor()
+        course_params = (course_code,) if course_code else ()
+        department_params = (department,) if department else ()
+        
+        # Days only another department attended are not absences for this one
+        cursor.execute(f"""
+            SELECT COUNT(DISTINCT d.date) FROM attendance_daily d
+            {"JOIN students s ON s.student_id = d.student_id" if department else ""}
+            WHERE d.date BETWEEN %s AND %s{" AND d.course_code = %s" if course_code else ""}
+            {"AND s.department = %s" if department else ""}
+        """, (start_date, end_date) + course_params + department_params)
+        class_days = cursor.fetchone()[0]
+        
+        query = f"""
+            SELECT s.student_id, s.name, s.department,
+                   COUNT(DISTINCT d.date) AS days_present,
+                   MIN(d.date) AS first_present, MAX(d.date) AS last_present
+            FROM students s
+            LEFT JOIN attendance_daily d
+                ON d.student_id = s.student_id AND d.date BETWEEN %s AND %s{" AND d.course_code = %s" if course_code else ""}
+            {"WHERE s.department = %s" if department else ""}
+            GROUP BY s.student_id, s.name, s.department
+            ORDER BY s.student_id ASC
+        """
+        cursor.execute(query, (start_date, end_date) + course_params + department_params)
+        results = cursor.fetchall()
+        cursor.close()
+    except Error as e:
+        print(f"Error fetching attendance range report: {e}")
+        return 0, None
+    finally:
+        connection.close()
+    
+    rows = []
+    for student_id, name, dept, days_present, first_present, last_present in results:
+        rows.append({
+            'id': student_id,
+            'name': name,
+            'department': dept,
+            'days_present': days_present,
+            'days_absent': max(0, class_days - days_present),
+            'percentage': round(days_present * 100.0 / class_days, 1) if class_days else 0.0,
+            'first_present': first_present.strftime('%Y-%m-%d') if first_present else None,
+            'last_present': last_present.strftime('%Y-%m-%d') if last_present else None
+        })
+    return class_days, rows
+
+def get_report_filters():
+    """Course codes and departments to offer as report filters"""
+    connection = create_connection()
+    if not connection:
+        return [], []
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT course_code FROM courses
+            UNION
+            SELECT DISTINCT course_code FROM attendance_daily WHERE course_code <> ''
+            ORDER BY course_code
+        """)
+        courses = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT DISTINCT department FROM students WHERE department IS NOT NULL ORDER BY department")
+        departments = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        return courses, departments
     except Error as e:
-        print(f"Error getting count: {e}")
-        return 0
+        print(f"Error fetching report filters: {e}")
+        return [], []
+    finally:
+        connection.close()
+
+def execute_admin_statements(statements):
+    """Run a list of cleanup statements in one transaction"""
+    connection = create_connection()
+    if not connection:
+        raise Error("Could not connect to database")
+    try:
+        cursor = connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        connection.commit()
+        cursor.close()
+    finally:
+        connection.close()
+
+# ---------------- Attendance Writer ----------------
+class AttendanceWriter:
+    """Write-behind sink that coalesces recognitions and flushes them in batches.
+
+    Batches go to write_batch(records, raise_errors=True), insert_attendance_batch
+    unless another sink is given.
+    """
+
+    def __init__(self, flush_interval=2.0, max_queue=10000, max_retries=150, write_batch=None):
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._write_batch = write_batch or insert_attendance_batch
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = {}
+        self._retries = {}
+        self._listeners = []
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.stats = {
+            'recognitions': 0,
+            'dropped': 0,
+            'flushes': 0,
+            'rows_written': 0,
+            'failed_flushes': 0,
+            'rows_rejected': 0,
+            'rows_expired': 0,
+            'last_flush_seconds': 0.0
+        }
+
+    def add_listener(self, callback):
+        """Call callback(records) after every successful flush"""
+        self._listeners.append(callback)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Stop the worker after writing everything still queued"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+
+    def record(self, student_id, name, department, seen_at=None, course_code=""):
+        """Queue a recognition; never blocks the caller"""
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait((student_id, name, department, course_code, seen_at or datetime.now()))
+            self.stats['recognitions'] += 1
+        except queue.Full:
+            self.stats['dropped'] += 1
+
+    def _merge(self, item):
+        student_id, name, department, course_code, seen_at = item
+        key = (student_id, seen_at.date(), course_code)
+        entry = self._pending.get(key)
+        if entry is None:
+            self._pending[key] = [name, department, seen_at, seen_at]
+        else:
+            entry[2] = min(entry[2], seen_at)
+            entry[3] = max(entry[3], seen_at)
+
+    def _drain(self, timeout):
+        try:
+            self._merge(self._queue.get(timeout=timeout))
+            while True:
+                self._merge(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while not self._stop.is_set():
+            self._drain(max(0.0, next_flush - time.monotonic()))
+            if time.monotonic() >= next_flush:
+                self.flush()
+                next_flush = time.monotonic() + self.flush_interval
+        self._drain(0)
+        self.flush()
+
+    def flush(self):
+        """Write all coalesced recognitions in one batch.
+
+        If the database is unreachable the rows are kept for the next window,
+        up to max_retries times. If the batch itself is rejected (e.g. a
+        student deleted meanwhile), rows are written one by one and the
+        rejected ones are logged and dropped, so one bad row can't block the
+        rest.
+        """
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        records = [
+            (student_id, name, department, course_code, first_seen, last_seen)
+            for (student_id, _, course_code), (name, department, first_seen, last_seen) in pending.items()
+        ]
+        started = time.monotonic()
+        try:
+            self._write_batch(records, raise_errors=True)
+            written = records
+        except Error as e:
+            if is_transient_db_error(e):
+                print(f"Error writing attendance batch, will retry: {e}")
+                self._retry(pending)
+                return
+            print(f"Attendance batch rejected ({e}); writing rows one by one")
+            written = self._write_rows(pending)
+        self.stats['flushes'] += 1
+        self.stats['rows_written'] += len(written)
+        ATTENDANCE_WRITES.inc(len(written))
+        self.stats['last_flush_seconds'] = time.monotonic() - started
+        for student_id, name, department, course_code, _, last_seen in written:
+            self._retries.pop((student_id, last_seen.date(), course_code), None)
+            print(f"✓ Attendance Updated: {student_id} - {name} ({department}) at {last_seen.strftime('%H:%M:%S')}")
+        if not written:
+            return
+        for callback in self._listeners:
+            try:
+                callback(written)
+            except Exception as e:
+                print(f"Error in attendance listener: {e}")
+
+    def _write_rows(self, pending):
+        """Write rows one at a time after a rejected batch; returns the written records"""
+        written = []
+        remaining = dict(pending)
+        for key, (name, department, first_seen, last_seen) in pending.items():
+            student_id, _, course_code = key
+            record = (student_id, name, department, course_code, first_seen, last_seen)
+            try:
+                self._write_batch([record], raise_errors=True)
+                written.append(record)
+                del remaining[key]
+            except Error as e:
+                if is_transient_db_error(e):
+                    self._retry(remaining)
+                    break
+                del remaining[key]
+                self.stats['rows_rejected'] += 1
+                self._retries.pop(key, None)
+                print(f"Dropped attendance row {student_id} on {last_seen.date()} ({course_code or '-'}): {e}")
+        return written
+
+    def _retry(self, pending):
+        """Keep rows for the next window, merging with anything newer, until they run out of retries"""
+        self.stats['failed_flushes'] += 1
+        ATTENDANCE_WRITE_FAILURES.inc()
+        for key, entry in pending.items():
+            retries = self._retries.get(key, 0) + 1
+            if retries > self.max_retries:
+                self._retries.pop(key, None)
+                self.stats['rows_expired'] += 1
+                print(f"Dropped attendance row {key[0]} on {key[1]} after {self.max_retries} failed writes")
+                continue
+            self._retries[key] = retries
+            newer = self._pending.get(key)
+            if newer:
+                entry[2] = min(entry[2], newer[2])
+                entry[3] = max(entry[3], newer[3])
+            self._pending[key] = entry
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['queued'] = self._queue.qsize()
+        stats['pending'] = len(self._pending)
+        return stats
+
+
+attendance_writer = AttendanceWriter(**ATTENDANCE_WRITER_CONFIG)
+atexit.register(attendance_writer.stop)
+
+# ---------------- Live Attendance Events ----------------
+class EventSubscriber:
+    """One SSE connection: a bounded queue of events plus a flag asking for a fresh snapshot"""
+
+    def __init__(self, queue_size):
+        self.events = queue.Queue(maxsize=queue_size)
+        self.needs_snapshot = True
+        self.day = None
+
+
+class AttendanceEventHub:
+    """Keeps today's attendance in memory and pushes committed changes to SSE viewers.
+
+    The day is loaded from MySQL once; after that it is kept current from the
+    attendance writer's flushes, so connecting viewers never re-query the table.
+    """
+
+    def __init__(self, max_subscribers=200, queue_size=256, heartbeat_interval=15.0, refresh_interval=300):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self.heartbeat_interval = heartbeat_interval
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._day = None
+        self._loaded_at = 0.0
+        self._rows = {}
+        self._subscribers = set()
+        self.stats = {'events': 0, 'snapshots': 0, 'overflows': 0}
+
+    def _load_day(self):
+        """(Re)load today's rows when the date has moved on or they are stale; caller holds the lock"""
+        today = date.today()
+        if self._day == today and time.monotonic() - self._loaded_at < self.refresh_interval:
+            return
+        self._rows = {}
+        for student_id, name, dept, time_str, course_code in get_today_attendance(include_course=True):
+            self._rows[(student_id, course_code)] = {
+                'id': student_id, 'name': name, 'dept': dept, 'time': time_str, 'course': course_code
+            }
+        self._day = today
+        self._loaded_at = time.monotonic()
+
+    def snapshot(self):
+        """Today's attendance, latest first"""
+        with self._lock:
+            self._load_day()
+            rows = [dict(row) for row in sorted(self._rows.values(), key=lambda row: row['time'], reverse=True)]
+            self.stats['snapshots'] += 1
+            return {'date': self._day.isoformat(), 'count': len(rows), 'attendance': rows}
+
+    def today_records(self):
+        """Today's attendance as (student_id, name, department, time) tuples, latest first"""
+        with self._lock:
+            self._load_day()
+            rows = sorted(self._rows.values(), key=lambda row: row['time'], reverse=True)
+            return [(row['id'], row['name'], row['dept'], row['time']) for row in rows]
+
+    def today_count(self):
+        with self._lock:
+            self._load_day()
+            return len(self._rows)
+
+    def subscribe(self):
+        """Register a viewer; returns None when max_subscribers are already connected"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscriber = EventSubscriber(self.queue_size)
+            self._subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _broadcast(self, event):
+        """Caller holds the lock; a viewer that falls behind is resynced with a snapshot"""
+        for subscriber in self._subscribers:
+            try:
+                subscriber.events.put_nowait(event)
+            except queue.Full:
+                self.stats['overflows'] += 1
+                subscriber.needs_snapshot = True
+
+    def on_attendance_flush(self, records):
+        """Attendance writer listener: apply committed rows and notify viewers"""
+        with self._lock:
+            if self._day is None:
+                # Nobody has asked for today yet, nothing to keep current
+                return
+            for student_id, name, department, course_code, _, last_seen in records:
+                if last_seen.date() != self._day:
+                    continue
+                key = (student_id, course_code or "")
+                time_str = last_seen.strftime('%H:%M:%S')
+                row = self._rows.get(key)
+                if row is None:
+                    row = {'id': student_id, 'name': name, 'dept': department,
+                           'time': time_str, 'course': course_code or ""}
+                    self._rows[key] = row
+                elif time_str > row['time']:
+                    row['time'] = time_str
+                else:
+                    continue
+                self._broadcast({'type': 'attendance', 'record': dict(row), 'count': len(self._rows)})
+                self.stats['events'] += 1
+
+    def reset(self):
+        """Forget the cached day (attendance was cleared) and resync every viewer"""
+        with self._lock:
+            self._day = None
+            self._rows = {}
+            for subscriber in self._subscribers:
+                subscriber.needs_snapshot = True
+                try:
+                    subscriber.events.put_nowait(None)
+                except queue.Full:
+                    pass
+
+    def stream(self, subscriber):
+        """Yield SSE messages for one viewer until the client disconnects"""
+        try:
+            while True:
+                if subscriber.needs_snapshot or subscriber.day != date.today():
+                    subscriber.needs_snapshot = False
+                    # Events queued before the snapshot are already part of it
+                    while not subscriber.events.empty():
+                        subscriber.events.get_nowait()
+                    data = self.snapshot()
+                    subscriber.day = date.today()
+                    yield f"event: snapshot\ndata: {json.dumps(data)}\n\n"
+                try:
+                    event = subscriber.events.get(timeout=self.heartbeat_interval)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is not None:
+                    yield f"event: attendance\ndata: {json.dumps(event)}\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['subscribers'] = len(self._subscribers)
+        stats['cached_rows'] = len(self._rows)
+        return stats
+
+
+attendance_events = AttendanceEventHub(**ATTENDANCE_EVENTS_CONFIG)
+attendance_writer.add_listener(attendance_events.on_attendance_flush)
+
+# ---------------- Dashboard Stats ----------------
+class StatsCache:
+    """Student counters for the dashboards, kept current by the write paths with a TTL re-count"""
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._counts = None
+        self._loaded_at = 0.0
+
+    def get(self):
+        """Return {'total_students', 'trained_count'}, re-counting when older than ttl"""
+        with self._lock:
+            if self._counts is None or time.monotonic() - self._loaded_at >= self.ttl:
+                counts = get_student_counts()
+                if counts is None:
+                    return dict(self._counts or {'total_students': 0, 'trained_count': 0})
+                self._counts = counts
+                self._loaded_at = time.monotonic()
+            return dict(self._counts)
+
+    def adjust(self, key, delta):
+        """Apply a known change without going back to the database"""
+        with self._lock:
+            if self._counts is not None:
+                self._counts[key] = max(0, self._counts[key] + delta)
+
+    def invalidate(self):
+        with self._lock:
+            self._counts = None
+
+
+stats_cache = StatsCache(**STATS_CACHE_CONFIG)
+
+# ---------------- Face Image Backups ----------------
+class BackupWriter:
+    """Writes StudentImages JPEG backups on a thread pool after the DB commit"""
+
+    def __init__(self, workers=4, chunk_size=25):
+        self.chunk_size = chunk_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backup")
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._generation = 0
+        self.written = 0
+        self.failed = 0
+        self.last_error = None
+
+    def submit(self, student_id, face_images):
+        """Queue backups for one student; returns immediately"""
+        face_images = list(face_images)
+        with self._lock:
+            generation = self._generation
+            self._pending[student_id] = self._pending.get(student_id, 0) + len(face_images)
+        for start in range(0, len(face_images), self.chunk_size):
+            chunk = face_images[start:start + self.chunk_size]
+            self._executor.submit(self._write_chunk, generation, student_id, start, chunk)
+
+    def _write_chunk(self, generation, student_id, start, chunk):
+        written = failed = 0
+        # Skip work queued before the student images were cleared
+        if generation == self._generation:
+            student_folder = os.path.join("StudentImages", student_id)
+            try:
+                os.makedirs(student_folder, exist_ok=True)
+                for idx, face_img in enumerate(chunk, start=start):
+                    img_path = os.path.join(student_folder, f"face_{idx+1}.jpg")
+                    if cv2.imwrite(img_path, face_img):
+                        written += 1
+                    else:
+                        failed += 1
+            except Exception as e:
+                failed = len(chunk) - written
+                self.last_error = f"{student_id}: {e}"
+                print(f"Error writing backup images for {student_id}: {e}")
+        with self._lock:
+            self.written += written
+            self.failed += failed
+            remaining = self._pending.get(student_id, 0) - len(chunk)
+            if remaining > 0:
+                self._pending[student_id] = remaining
+            else:
+                self._pending.pop(student_id, None)
+
+    def cancel_pending(self):
+        """Drop queued writes, e.g. before StudentImages is wiped"""
+        with self._lock:
+            self._generation += 1
+
+    def get_status(self):
+        with self._lock:
+            return {
+                'pending_images': sum(self._pending.values()),
+                'pending_students': sorted(self._pending),
+                'written': self.written,
+                'failed': self.failed,
+                'last_error': self.last_error
+            }
+
+
+backup_writer = BackupWriter(**BACKUP_CONFIG)
+
+# ---------------- Unknown Face Recorder ----------------
+class UnknownFaceRecorder:
+    """Saves unknown face crops off the recognition thread, rate limited per tracked face"""
+
+    def __init__(self, directory="UnknownFaces", min_interval=10.0, max_per_track=3,
+                 max_files=5000, max_age_days=30, cleanup_interval=600, max_queue=256):
+        self.directory = directory
+        self.min_interval = min_interval
+        self.max_per_track = max_per_track
+        self.max_files = max_files
+        self.max_age_days = max_age_days
+        self.cleanup_interval = cleanup_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        # track_key -> (crops saved, last saved, last seen), least recently seen first
+        self._seen = OrderedDict()
+        self._counter = None
+        self._thread = None
+        self._last_cleanup = 0.0
+        self.stats = {'saved': 0, 'suppressed': 0, 'dropped': 0, 'deleted': 0, 'errors': 0}
+
+    def _next_number(self):
+        """Monotonic file number; the directory is scanned once, not per face"""
+        if self._counter is None:
+            highest = 0
+            if os.path.exists(self.directory):
+                for name in os.listdir(self.directory):
+                    stem = os.path.splitext(name)[0]
+                    if stem.startswith("Unknown_") and stem[8:].isdigit():
+                        highest = max(highest, int(stem[8:]))
+            self._counter = itertools.count(highest + 1)
+        return next(self._counter)
+
+    def _allow(self, key, now):
+        """Rate limit: at most max_per_track crops per face, min_interval apart.
 
-def insert_attendance(student_id, student_name, department, date_val, time_val, course_code=""):
-    """Insert attendance record"""
-    try:
-        connection = create_connection()
-        if connection:
-            cursor = connection.cursor()
-            query = """
-                INSERT INTO attendance (student_id, student_name, department, course_code, date, time) 
-                VALUES (%s, %s, %s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE time = %s
-            """
-            cursor.execute(query, (student_id, student_name, department, course_code, date_val, time_val, time_val))
-            connection.commit()
-            cursor.close()
-            connection.close()
-            return True
-    except Error as e:
-        print(f"Error inserting attendance: {e}")
-        return False
+        Faces not seen for 10 * min_interval are forgotten.
+        """
+        cutoff = now - 10 * self.min_interval
+        while self._seen and next(iter(self._seen.values()))[2] < cutoff:
+            self._seen.popitem(last=False)
+        count, last, _ = self._seen.pop(key, (0, float('-inf'), now))
+        allowed = count < self.max_per_track and now - last >= self.min_interval
+        if allowed:
+            count, last = count + 1, now
+        self._seen[key] = (count, last, now)
+        return allowed
 
-def get_today_attendance():
-    """Get today's attendance records with properly formatted time"""
-    try:
-        connection = create_connection()
-        if connection:
-            cursor = connection.cursor()
-            today = date.today()
-            query = """
-                SELECT student_id, student_name, department, time 
-                FROM attendance 
-                WHERE date = %s
-                ORDER BY time DESC
-            """
-            cursor.execute(query, (today,))
-            results = cursor.fetchall()
-            cursor.close()
-            connection.close()
-            
-            # Format time properly
-            formatted_results = []
-            for record in results:
-                student_id, name, dept, time_val = record
-                if time_val:
-                    # Handle both time objects and timedelta objects
-                    if isinstance(time_val, timedelta):
-                        total_seconds = int(time_val.total_seconds())
-                        hours = total_seconds // 3600
-                        minutes = (total_seconds % 3600) // 60
-                        seconds = total_seconds % 60
-                        formatted_time = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-                    else:
-                        formatted_time = str(time_val)
-                else:
-                    formatted_time = "00:00:00"
-                
-                formatted_results.append((student_id, name, dept, formatted_time))
-            
-            return formatted_results
-    except Error as e:
-        print(f"Error fetching attendance: {e}")
-        return []
+    def record(self, face_img, track_key):
+        """Queue an unknown face crop; track_key identifies the same person across frames"""
+        now = time.time()
+        with self._lock:
+            if not self._allow(track_key, now):
+                self.stats['suppressed'] += 1
+                return
+            number = self._next_number()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="unknown-faces", daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait((number, face_img.copy(), datetime.fromtimestamp(now)))
+        except queue.Full:
+            self.stats['dropped'] += 1
 
-def get_all_students():
-    """Get all registered students"""
-    try:
-        connection = create_connection()
-        if connection:
-            cursor = connection.cursor()
-            query = "SELECT student_id, name, department, is_trained FROM students ORDER BY created_at DESC"
-            cursor.execute(query)
-            results = cursor.fetchall()
-            cursor.close()
-            connection.close()
-            return results
-    except Error as e:
-        print(f"Error fetching students: {e}")
-        return []
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            # One bad crop or a database hiccup must not end the thread
+            try:
+                self._save_batch(batch)
+                if time.time() - self._last_cleanup >= self.cleanup_interval:
+                    self.apply_retention()
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"Error saving unknown faces: {e}")
 
-def log_unknown_face(image_path):
-    """Log unknown face detection"""
-    try:
-        connection = create_connection()
-        if connection:
-            cursor = connection.cursor()
-            query = "INSERT INTO unknown_faces (image_path) VALUES (%s)"
-            cursor.execute(query, (image_path,))
-            connection.commit()
-            cursor.close()
-            connection.close()
-    except Error as e:
-        print(f"Error logging unknown face: {e}")
+    def _save_batch(self, batch):
+        os.makedirs(self.directory, exist_ok=True)
+        records = []
+        for number, face_img, detected_at in batch:
+            unknown_path = f"{self.directory}/Unknown_{number}.jpg"
+            if face_img.size and cv2.imwrite(unknown_path, face_img):
+                records.append((unknown_path, detected_at.strftime('%Y-%m-%d %H:%M:%S')))
+        log_unknown_faces_batch(records)
+        self.stats['saved'] += len(records)
 
-def get_full_report_by_date(selected_date):
-    """
-    Get a full report: all students LEFT JOIN grouped attendance times for the selected date.
-    """
-    try:
-        connection = create_connection()
-        if connection:
-            cursor = connection.cursor()
-            
-            attendance_summary_query = """
-                SELECT 
-                    student_id, 
-                    MIN(timestamp) AS in_time_dt,
-                    MAX(time) AS out_time_col
-                FROM attendance
-                WHERE date = %s
-                GROUP BY student_id
-            """
-            
-            main_query = """
-                SELECT 
-                    s.student_id, 
-                    s.name, 
-                    s.department,
-                    T.in_time_dt,
-                    T.out_time_col
-                FROM students s
-                LEFT JOIN ({}) AS T
-                ON s.student_id = T.student_id
-                ORDER BY s.student_id ASC;
-            """.format(attendance_summary_query)
-            
-            cursor.execute(main_query, (selected_date,))
-            results = cursor.fetchall()
-            cursor.close()
-            connection.close()
+    def apply_retention(self):
+        """Delete crops (and their log rows) older than max_age_days or beyond max_files"""
+        self._last_cleanup = time.time()
+        if not os.path.exists(self.directory):
+            return
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file():
+                    entries.append((entry.stat().st_mtime, entry.path))
+        entries.sort()
+        
+        cutoff = time.time() - self.max_age_days * 86400
+        excess = max(0, len(entries) - self.max_files)
+        doomed = [path for idx, (mtime, path) in enumerate(entries) if idx < excess or mtime < cutoff]
+        for path in doomed:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Error removing {path}: {e}")
+        
+        # Stored paths use forward slashes, as written by _run
+        removed_paths = [f"{self.directory}/{os.path.basename(path)}" for path in doomed]
+        delete_unknown_face_logs(older_than=datetime.fromtimestamp(cutoff), image_paths=removed_paths)
+        self.stats['deleted'] += len(doomed)
+        if doomed:
+            print(f"✓ Unknown faces retention: removed {len(doomed)} files")
 
-            report = []
-            for row in results:
-                student_id, name, dept, in_time_dt, out_time_col = row
-                
-                status = "Present" if in_time_dt or out_time_col else "Absent"
-                
-                # Format in_time (datetime object)
-                in_time_display = in_time_dt.strftime('%H:%M:%S') if in_time_dt else "-"
-                
-                # Format out_time (could be timedelta or time object)
-                if out_time_col:
-                    if isinstance(out_time_col, timedelta):
-                        total_seconds = int(out_time_col.total_seconds())
-                        hours = total_seconds // 3600
-                        minutes = (total_seconds % 3600) // 60
-                        seconds = total_seconds % 60
-                        out_time_display = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-                    else:
-                        out_time_display = str(out_time_col)
-                else:
-                    out_time_display = "-"
-
-                report.append({
-                    'id': student_id,
-                    'name': name,
-                    'department': dept,
-                    'in_time': in_time_display,
-                    'out_time': out_time_display,
-                    'status': status
-                })
-            return report
-            
-    except Error as e:
-        print(f"Error fetching full attendance report: {e}")
-        return []
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['queued'] = self._queue.qsize()
+        return stats
+
+
+unknown_face_recorder = UnknownFaceRecorder(**UNKNOWN_FACES_CONFIG)
 
 # Global variables for face recognition
 recognizer = None
 faceCascade = None
+faceCascadePath = None
+camera_registry = CameraRegistry()
 id_to_student = {}
+# LBPH label -> (student_id, name, department), so recognition needs no DB reads
+student_directory = {}
+# (recognizer, student_directory, worker_model_path) read as one reference, so a
+# retrain can never pair a new model with an old label map
+active_recognition = (None, {}, None)
+# Camera workers load the model from their own copy of it, named once per trained model,
+# so a retrain overwriting BUBTModel.yml can't hand them a file that doesn't match their map
+WORKER_MODEL_DIR = "TrainingModel/workers"
+# Worker model copies replaced by a newer model, oldest first
+retired_worker_models = []
+# Bumped on every activation, so a slow directory rebuild can't reinstate a replaced model
+recognition_generation = 0
+recognition_lock = threading.Lock()
 # -------- CHANGED: Remove tracked_today set to allow multiple attendance marks --------
 # We'll track attendance in database instead of memory
 
+def build_student_directory(label_map):
+    """Build the label -> (student_id, name, department) cache for a label map"""
+    details = get_student_directory(list(label_map.values()))
+    directory = {
+        label: (student_id,) + details[student_id]
+        for label, student_id in label_map.items()
+        if student_id in details
+    }
+    print(f"✓ Student directory loaded: {len(directory)} students")
+    return directory
+
+def save_file_atomically(path, write):
+    """Call write(temp_path) and move the result over `path`, so no reader sees a half-written file"""
+    root, ext = os.path.splitext(path)
+    # Keep the extension: OpenCV picks the model file format from it
+    temp_path = f"{root}.tmp{ext}"
+    write(temp_path)
+    os.replace(temp_path, path)
+
+def dump_pickle(obj, path):
+    with open(path, "wb") as f:
+        pickle.dump(obj, f)
+
+def snapshot_model_for_workers(model, model_file=None):
+    """Write a copy of `model` for camera workers under a name no other model uses.
+
+    model_file, a file holding exactly this model, is hard-linked instead of
+    saving the model again when the filesystem allows it.
+    """
+    if model is None:
+        return None
+    os.makedirs(WORKER_MODEL_DIR, exist_ok=True)
+    path = os.path.join(WORKER_MODEL_DIR, f"BUBTModel-{uuid.uuid4().hex[:12]}.yml")
+    if model_file is not None:
+        try:
+            os.link(model_file, path)
+            return path
+        except OSError:
+            pass
+    save_file_atomically(path, model.save)
+    return path
+
+def activate_recognition_model(model, label_map, generation=None, worker_model_path=None):
+    """Hot-swap the recognizer and its label/student caches in one step.
+
+    worker_model_path is the snapshot_model_for_workers() copy of `model`
+    that camera workers load. With `generation`, nothing changes (and
+    False is returned) if another model was activated since that
+    generation was read.
+    """
+    global recognizer, id_to_student, student_directory, active_recognition, recognition_generation
+    # Built before swapping so the recognition loop never sees a half-empty cache
+    directory = build_student_directory(label_map) if label_map else {}
+    with recognition_lock:
+        if generation is not None and generation != recognition_generation:
+            return False
+        previous_path = active_recognition[2]
+        recognizer, id_to_student, student_directory = model, label_map, directory
+        active_recognition = (model, directory, worker_model_path)
+        recognition_generation += 1
+        if previous_path not in (None, worker_model_path):
+            retired_worker_models.append(previous_path)
+        # The last replaced copy is kept: a worker started just before this swap may not have read it yet
+        expired = retired_worker_models[:-1]
+        del retired_worker_models[:-1]
+        MODEL_STUDENTS.set(len(label_map))
+        # getLabels() is one int per sample, unlike getHistograms()
+        MODEL_SAMPLES.set(len(model.getLabels()) if model is not None else 0)
+    # Workers are sent whatever is active by then, so out-of-order calls still end on the newest model
+    camera_manager.publish_model()
+    for path in expired:
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"Error removing old worker model {path}: {e}")
+    return True
+
+def invalidate_student_directory():
+    """Reload cached student details after student data changes"""
+    with recognition_lock:
+        model, label_map, generation = recognizer, id_to_student, recognition_generation
+        worker_model_path = active_recognition[2]
+    if not activate_recognition_model(model, label_map, generation, worker_model_path):
+        print("✓ Student directory refresh skipped: a newer model was activated meanwhile")
+
 def initialize_face_recognition():
     """Initialize face recognition components"""
-    global recognizer, faceCascade, id_to_student
+    global faceCascade, faceCascadePath
     
     # Load face detector
     harcascadePath = "haarcascade_frontalface_default.xml"
-    if os.path.exists(harcascadePath):
-        faceCascade = cv2.CascadeClassifier(harcascadePath)
-    else:
+    if not os.path.exists(harcascadePath):
         print("Warning: haarcascade_frontalface_default.xml not found")
-        faceCascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        harcascadePath = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+    faceCascade = cv2.CascadeClassifier(harcascadePath)
+    faceCascadePath = harcascadePath
     
     # Load trained model if exists
+    model = None
+    label_map = {}
+    worker_model_path = None
+    # Copies left by a previous run; no worker is running yet
+    shutil.rmtree(WORKER_MODEL_DIR, ignore_errors=True)
     if os.path.exists("TrainingModel/BUBTModel.yml"):
-        recognizer = cv2.face.LBPHFaceRecognizer_create()
-        recognizer.read("TrainingModel/BUBTModel.yml")
+        model = cv2.face.LBPHFaceRecognizer_create()
+        model.read("TrainingModel/BUBTModel.yml")
+        worker_model_path = snapshot_model_for_workers(model, "TrainingModel/BUBTModel.yml")
         
         # Load student mapping
         if os.path.exists("TrainingModel/student_map.pkl"):
             with open("TrainingModel/student_map.pkl", "rb") as f:
                 student_id_map = pickle.load(f)
-                id_to_student = {v: k for k, v in student_id_map.items()}
+                label_map = {v: k for k, v in student_id_map.items()}
+    
+    activate_recognition_model(model, label_map, worker_model_path=worker_model_path)
+
+# ---------------- Camera Workers ----------------
+def course_for_camera(camera, when):
+    """Course taught in the camera's room at `when`: a matching timetable slot, else its course_code"""
+    day = when.strftime('%a')
+    clock = when.strftime('%H:%M')
+    for slot in camera.get('timetable', ()):
+        if day in slot['days'] and slot['start'] <= clock < slot['end']:
+            return slot['course_code']
+    return camera.get('course_code', '')
+
+
+class CameraWorker:
+    """Main-process handle on one camera's recognition process"""
+
+    def __init__(self, camera_id, config):
+        self.camera_id = camera_id
+        self.config = config
+        self.process = None
+        self.control = None
+        self.frames = None
+        self.viewer_count = None
+        self.broadcaster = FrameBroadcaster()
+        self.viewers = 0
+        # Track IDs restart with each process, so unknown-face keys include this
+        self.starts = 0
+        self.stopping = None
+        self.stats = {}
+        self.metrics = {}
+        self.error = None
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.is_alive()
+
+    def _forward_frames(self, process, frames, broadcaster):
+        """Publish JPEG frames from the worker to this process's viewers"""
+        while process.is_alive():
+            try:
+                broadcaster.publish(frames.get(timeout=1.0))
+            except queue.Empty:
+                continue
+        broadcaster.close()
+
+
+class CameraManager:
+    """Starts a worker process per camera and routes their results into the app.
+
+    Each process loads its own copy of the active model file, sent together
+    with the label -> student map, and is sent a new pair whenever the
+    active model changes.
+    Registration capture opens its device in this process, so workers on the
+    same device are paused while a capture holds it (hold_source()).
+    """
+
+    def __init__(self, cameras):
+        # spawn: a fork of this threaded server could inherit held locks
+        self._context = multiprocessing.get_context('spawn')
+        self.workers = {camera_id: CameraWorker(camera_id, config) for camera_id, config in cameras.items()}
+        self._results = None
+        self._dispatcher = None
+        self._lock = threading.Lock()
+        self._always_on_started = False
+        self._held_sources = {}
+
+    def _model_settings(self):
+        _, directory, model_path = active_recognition
+        return model_path, dict(directory)
+
+    def _start(self, worker):
+        """Launch the worker process; caller holds the lock"""
+        if self._results is None:
+            self._results = self._context.Queue()
+            self._dispatcher = threading.Thread(target=self._dispatch_results, name="camera-results", daemon=True)
+            self._dispatcher.start()
+        model_path, names = self._model_settings()
+        settings = {
+            'width': 640,
+            'height': 480,
+            'cascade_path': faceCascadePath,
+            'camera_setup': CLASSROOM_CAMERA_SETUP,
+            'detection': dict(DETECTION_CONFIG, scale_factor=1.2, min_neighbors=5),
+            'tracker': TRACKER_CONFIG,
+            'title': f"BUBT Attendance System - {worker.config.get('room', worker.camera_id)}",
+            'model_path': model_path,
+            'names': names,
+            'recognizer_backend': RECOGNIZER_CONFIG['backend'],
+            **PIPELINE_CONFIG
+        }
+        worker.control = self._context.Queue()
+        worker.frames = self._context.Queue(maxsize=2)
+        worker.viewer_count = self._context.Value('i', worker.viewers)
+        worker.broadcaster = FrameBroadcaster()
+        worker.error = None
+        worker.starts += 1
+        worker.process = self._context.Process(
+            target=run_camera_worker,
+            args=(worker.camera_id, worker.config['source'], settings, worker.control,
+                  self._results, worker.frames, worker.viewer_count),
+            name=f"camera-{worker.camera_id}",
+            daemon=True
+        )
+        worker.process.start()
+        threading.Thread(target=worker._forward_frames, args=(worker.process, worker.frames, worker.broadcaster),
+                         name=f"camera-{worker.camera_id}-frames", daemon=True).start()
+        print(f"✓ Camera {worker.camera_id} started (pid {worker.process.pid})")
+
+    def _stop(self, worker):
+        """Ask the worker to finish; caller holds the lock and then calls _join() without it"""
+        process = worker.process
+        if process is None:
+            return None
+        if process.is_alive():
+            worker.control.put(('stop',))
+        worker.process = None
+        worker.stopping = process
+        worker.broadcaster.close()
+        return process
+
+    @staticmethod
+    def _join(process):
+        """Wait for a stopped worker to exit, killing it if it doesn't"""
+        if process is None:
+            return
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+            process.join(timeout=1)
+
+    def acquire(self, camera_id):
+        """Join a camera's live view, starting its worker if needed; None for an unknown camera"""
+        worker = self.workers.get(camera_id)
+        if worker is None:
+            return None
+        # A worker that is still shutting down holds the camera; let it exit first
+        self._join(worker.stopping)
+        with self._lock:
+            worker.viewers += 1
+            try:
+                if not worker.running and not self.is_paused(worker):
+                    self._start(worker)
+            except Exception:
+                worker.viewers -= 1
+                raise
+            # A worker paused before its first start has no shared count yet; _start() seeds it
+            if worker.viewer_count is not None:
+                worker.viewer_count.value = worker.viewers
+        return worker
+
+    def release(self, worker):
+        """Leave a live view, stopping the worker after the last viewer unless it is always on"""
+        process = None
+        with self._lock:
+            worker.viewers -= 1
+            if worker.viewer_count is not None:
+                worker.viewer_count.value = max(0, worker.viewers)
+            if worker.viewers <= 0 and not worker.config.get('always_on'):
+                process = self._stop(worker)
+        self._join(process)
+
+    def start_always_on(self):
+        if self._always_on_started:
+            return
+        with self._lock:
+            if self._always_on_started:
+                return
+            self._always_on_started = True
+            for worker in self.workers.values():
+                if worker.config.get('always_on') and not worker.running and not self.is_paused(worker):
+                    self._start(worker)
+
+    def is_paused(self, worker):
+        """True while a registration capture holds this worker's device"""
+        return self._held_sources.get(worker.config['source'], 0) > 0
+
+    def hold_source(self, source):
+        """Stop the workers reading `source` so this process can open it; pair with release_source()"""
+        with self._lock:
+            self._held_sources[source] = self._held_sources.get(source, 0) + 1
+            processes = [self._stop(worker) for worker in self.workers.values()
+                         if worker.config['source'] == source]
+        for process in processes:
+            self._join(process)
+            if process is not None:
+                print(f"✓ Camera worker paused while device {source} is used for registration")
+
+    def release_source(self, source):
+        """Restart the workers on `source` that still have viewers or are always on"""
+        with self._lock:
+            self._held_sources[source] = self._held_sources.get(source, 1) - 1
+            if self._held_sources[source] > 0:
+                return
+            # Started before the hold is lifted, so a paused viewer finds the new broadcaster
+            for worker in self.workers.values():
+                if (worker.config['source'] == source and not worker.running
+                        and (worker.viewers > 0 or worker.config.get('always_on'))):
+                    self._start(worker)
+            del self._held_sources[source]
+
+    def stop_all(self):
+        with self._lock:
+            processes = [self._stop(worker) for worker in self.workers.values()]
+        for process in processes:
+            self._join(process)
+
+    def publish_model(self):
+        """Tell running workers to switch to the active model and student map"""
+        model_path, names = self._model_settings()
+        with self._lock:
+            for worker in self.workers.values():
+                if worker.running:
+                    worker.control.put(('model', model_path, names))
+
+    def _dispatch_results(self):
+        while True:
+            message = self._results.get()
+            kind, camera_id = message[0], message[1]
+            worker = self.workers.get(camera_id)
+            if worker is None:
+                continue
+            try:
+                if kind == 'seen':
+                    for student_id, name, department, seen_ts in message[2]:
+                        seen_at = datetime.fromtimestamp(seen_ts)
+                        attendance_writer.record(student_id, name, department, seen_at=seen_at,
+                                                 course_code=course_for_camera(worker.config, seen_at))
+                elif kind == 'unknown':
+                    unknown_face_recorder.record(message[3], (camera_id, worker.starts, message[2]))
+                elif kind == 'stats':
+                    worker.stats = message[2]
+                elif kind == 'metrics':
+                    worker.metrics = message[2]
+                elif kind == 'error':
+                    worker.error = message[2]
+                    print(f"Camera {camera_id}: {message[2]}")
+            except Exception as e:
+                print(f"Error handling result from camera {camera_id}: {e}")
+
+    def metric_sources(self):
+        """(labels, snapshot) of each camera's last reported metrics, for metrics.REGISTRY.render()"""
+        return [({'camera': camera_id}, worker.metrics)
+                for camera_id, worker in self.workers.items() if worker.metrics]
+
+    def get_stats(self):
+        stats = {}
+        now = datetime.now()
+        for camera_id, worker in self.workers.items():
+            stats[camera_id] = {
+                'room': worker.config.get('room'),
+                'source': worker.config['source'],
+                'course_code': course_for_camera(worker.config, now),
+                'running': worker.running,
+                'pid': worker.process.pid if worker.running else None,
+                'viewers': worker.viewers,
+                'paused': self.is_paused(worker),
+                'error': worker.error,
+                'pipeline': worker.stats if worker.running else {}
+            }
+        return stats
+
+
+camera_manager = CameraManager(CAMERAS)
+atexit.register(camera_manager.stop_all)
+
+# ---------------- Model Training ----------------
+def load_training_state():
+    """Load the saved label map and the student versions the model was trained on"""
+    student_map, manifest = {}, {}
+    if os.path.exists("TrainingModel/student_map.pkl"):
+        with open("TrainingModel/student_map.pkl", "rb") as f:
+            student_map = pickle.load(f)
+    if os.path.exists("TrainingModel/model_manifest.pkl"):
+        with open("TrainingModel/model_manifest.pkl", "rb") as f:
+            manifest = pickle.load(f)
+    return student_map, manifest
+
+def train_recognizer(full_retrain=False, progress=None):
+    """Train the LBPH model, incrementally when possible.
+
+    Incremental mode feeds only students missing from the model into
+    LBPH update(). LBPH can't forget samples, so if any modelled student
+    was changed or removed since the last run a full retrain is done
+    instead. The new model is hot-swapped in once saved. Returns a result
+    dict for the training routes.
+    """
+    if progress is None:
+        progress = lambda phase, **counts: None
+    progress('loading')
+    versions = get_trained_student_versions()
+    student_map, manifest = load_training_state()
+    
+    mode = 'full'
+    if not full_retrain and os.path.exists("TrainingModel/BUBTModel.yml") and student_map and manifest:
+        stale = [sid for sid, version in manifest.items() if versions.get(sid) != version]
+        if stale:
+            print(f"{len(stale)} students changed or removed since last training - running full retrain")
+        else:
+            mode = 'incremental'
+    
+    if mode == 'incremental':
+        new_ids = [sid for sid in versions if sid not in manifest]
+        if not new_ids:
+            return {'success': True, 'mode': mode, 'students': 0, 'samples': 0,
+                    'message': f'Model is already up to date with {len(student_map)} students.'}
+        
+        faces, ids, new_map = get_face_data_for_students(new_ids, first_label=max(student_map.values()) + 1,
+                                                         progress=progress)
+        if len(faces) == 0:
+            return {'success': False, 'mode': mode, 'message': 'No face data found for new students.'}
+        
+        progress('training', samples=len(faces))
+        model = cv2.face.LBPHFaceRecognizer_create()
+        model.read("TrainingModel/BUBTModel.yml")
+        model.update(faces, ids)
+        student_map.update(new_map)
+    else:
+        faces, ids, new_map = get_all_face_data(progress=progress)
+        if len(faces) == 0:
+            return {'success': False, 'mode': mode,
+                    'message': 'No training data found! Please register students first.'}
+        
+        progress('training', samples=len(faces))
+        model = cv2.face.LBPHFaceRecognizer_create()
+        model.train(faces, ids)
+        student_map, manifest = new_map, {}
+    
+    manifest.update({sid: versions[sid] for sid in new_map if sid in versions})
+    
+    progress('saving')
+    os.makedirs("TrainingModel", exist_ok=True)
+    save_file_atomically("TrainingModel/BUBTModel.yml", model.save)
+    worker_model_path = snapshot_model_for_workers(model, "TrainingModel/BUBTModel.yml")
+    save_file_atomically("TrainingModel/student_map.pkl", functools.partial(dump_pickle, student_map))
+    save_file_atomically("TrainingModel/model_manifest.pkl", functools.partial(dump_pickle, manifest))
+    
+    # Serve the freshly trained model without re-reading it from disk
+    activate_recognition_model(model, {v: k for k, v in student_map.items()}, worker_model_path=worker_model_path)
+    
+    if mode == 'incremental':
+        message = (f'Model updated incrementally! Added {len(new_map)} new students with {len(faces)} samples '
+                   f'({len(student_map)} students in model).')
+    else:
+        message = f'Model trained successfully! Trained {len(student_map)} students with {len(faces)} samples.'
+    return {'success': True, 'mode': mode, 'students': len(new_map), 'samples': len(faces), 'message': message}
+
+# ---------------- Background Training Jobs ----------------
+training_jobs = {}
+training_jobs_lock = threading.Lock()
+MAX_TRAINING_JOBS_KEPT = 20
+
+def start_training_job(full_retrain=False):
+    """Start a training job in the background, or return the one already running"""
+    with training_jobs_lock:
+        for job in training_jobs.values():
+            if job['status'] in ('queued', 'running'):
+                return job
+        
+        job = {
+            'job_id': uuid.uuid4().hex[:12],
+            'status': 'queued',
+            'phase': 'queued',
+            'full_retrain': full_retrain,
+            'total_students': 0,
+            'students': 0,
+            'samples': 0,
+            'peak_rss_mb': get_peak_rss_mb(),
+            'message': 'Training queued',
+            'started_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'finished_at': None
+        }
+        training_jobs[job['job_id']] = job
+        
+        # Keep only the most recent jobs
+        for old_id in list(training_jobs)[:-MAX_TRAINING_JOBS_KEPT]:
+            del training_jobs[old_id]
+    
+    threading.Thread(target=run_training_job, args=(job,), name=f"training-{job['job_id']}", daemon=True).start()
+    return job
+
+def run_training_job(job):
+    """Worker body for a background training job"""
+    def progress(phase, **counts):
+        job['phase'] = phase
+        job.update(counts)
+    
+    job['status'] = 'running'
+    try:
+        result = train_recognizer(full_retrain=job['full_retrain'], progress=progress)
+        job['status'] = 'done' if result['success'] else 'failed'
+        job['peak_rss_mb'] = get_peak_rss_mb()
+        job['mode'] = result.get('mode')
+        job['message'] = result['message']
+    except Exception as e:
+        print(f"Error in training job {job['job_id']}: {e}")
+        job['status'] = 'failed'
+        job['message'] = f'Error training model: {str(e)}'
+    job['phase'] = job['status']
+    job['finished_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+@app.before_request
+def start_always_on_cameras():
+    """Start the app and its always-on cameras with the first request, in the process that serves them"""
+    start_app()
+    camera_manager.start_always_on()
 
 # Context processor to make current_date available to all templates
 @app.context_processor
 def inject_current_date():
     return {'current_date': date.today()}
 
-# Initialize on startup
-initialize_database()
-initialize_face_recognition()
+# Start-up work runs when the app is served, not on import: camera worker processes
+# (spawned, so they re-import this module) and tools such as batch_attendance.py
+# import it only for its helpers
+app_started = False
+app_start_lock = threading.Lock()
 
-# Create necessary directories
-os.makedirs("StudentImages", exist_ok=True)
-os.makedirs("TrainingModel", exist_ok=True)
-os.makedirs("UnknownFaces", exist_ok=True)
+def start_app():
+    """Create the database and directories and load the model, once per serving process"""
+    global app_started
+    if app_started:
+        return
+    with app_start_lock:
+        if app_started:
+            return
+        initialize_database()
+        initialize_face_recognition()
+        os.makedirs("StudentImages", exist_ok=True)
+        os.makedirs("TrainingModel", exist_ok=True)
+        os.makedirs("UnknownFaces", exist_ok=True)
+        app_started = True
 
 # ---------------- Routes ----------------
 @app.route('/')
 def index():
     """Home page"""
-    today_attendance = get_today_attendance()
-    total_students = len(get_all_students())
-    trained_count = get_trained_students_count()
+    today_attendance = attendance_events.today_records()
+    counts = stats_cache.get()
     
     return render_template('index.html', 
                          attendance_count=len(today_attendance),
-                         total_students=total_students,
-                         trained_count=trained_count,
+                         total_students=counts['total_students'],
+                         trained_count=counts['trained_count'],
                          today_attendance=today_attendance)
 
 @app.route('/register')
 def register_page():
     """Student registration page"""
-    return render_template('register.html')
+    return render_template('register.html', camera_indexes=CAPTURE_CONFIG['camera_indexes'],
+                           default_camera=CAPTURE_CONFIG['camera_index'])
 
 @app.route('/register_student', methods=['POST'])
 def register_student():
@@ -475,8 +2532,16 @@ def register_student():
     if existing_name:
         return jsonify({'success': False, 'message': f'Student ID {student_id} already exists!'})
     
-    # -------- CHANGED: Reset capture before new registration --------
-    reset_capture_globals()
+    camera_index = request.form.get('camera_index', CAPTURE_CONFIG['camera_index'], type=int)
+    if camera_index not in CAPTURE_CONFIG['camera_indexes']:
+        return jsonify({'success': False, 'message': 'Please choose one of the registration cameras.'})
+    
+    # Each registration gets its own capture session so desks don't share buffers
+    discard_capture_session(session.get('capture_session_id'))
+    capture = create_capture_session(camera_index)
+    if capture is None:
+        return jsonify({'success': False, 'message': 'Too many registrations in progress. Please try again shortly.'})
+    session['capture_session_id'] = capture.session_id
     
     # Store in session for face capture
     session['registering_student'] = {
@@ -498,33 +2563,40 @@ def capture_faces():
 @app.route('/start_capture')
 def start_capture():
     """Initialize face capture session"""
-    global capture_complete, captured_faces, capture_in_progress
-    
     print("\n=== START_CAPTURE CALLED ===")
     
-    # -------- CHANGED: Reset all capture state using function --------
-    reset_capture_globals()
-    capture_in_progress = True
+    capture = get_capture_session(session.get('capture_session_id'))
+    if capture is None:
+        return jsonify({'success': False, 'message': 'Capture session expired. Please register again.'})
     
-    print(f"Capture state: complete={capture_complete}, in_progress={capture_in_progress}, faces={len(captured_faces)}")
+    # Two desks on one device would each get the other's frames (and faces)
+    if not claim_capture_camera(capture):
+        return jsonify({'success': False,
+                        'message': f'Camera {capture.camera_index} is in use by another registration. '
+                                   'Please wait for it to finish.'})
+    
+    print(f"Capture state [{capture.session_id}]: complete={capture.complete}, in_progress={capture.in_progress}, faces={len(capture.faces)}")
     
     return jsonify({'success': True, 'message': 'Capture started'})
 
 @app.route('/check_capture_status')
 def check_capture_status():
     """Check if face capture is complete"""
-    global capture_complete, captured_faces, capture_in_progress
+    capture = get_capture_session(session.get('capture_session_id'))
     
     return jsonify({
-        'complete': capture_complete,
-        'in_progress': capture_in_progress,
-        'face_count': len(captured_faces)
+        'complete': capture.complete if capture else False,
+        'in_progress': capture.in_progress if capture else False,
+        'face_count': len(capture.faces) if capture else 0,
+        'target': CAPTURE_CONFIG['target_samples'],
+        'minimum': CAPTURE_CONFIG['min_samples']
     })
 
 @app.route('/save_captured_faces', methods=['POST'])
 def save_captured_faces():
     """Save the captured faces to database"""
-    global captured_faces
+    capture = get_capture_session(session.get('capture_session_id'))
+    captured_faces = capture.faces if capture else []
     
     print(f"\n=== SAVE_CAPTURED_FACES CALLED ===")
     print(f"Captured faces count: {len(captured_faces)}")
@@ -535,10 +2607,10 @@ def save_captured_faces():
             'message': 'No student data in session'
         })
     
-    if len(captured_faces) < 20:
+    if len(captured_faces) < CAPTURE_CONFIG['min_samples']:
         return jsonify({
             'success': False, 
-            'message': f'Not enough faces captured: {len(captured_faces)}/20 minimum'
+            'message': f"Not enough faces captured: {len(captured_faces)}/{CAPTURE_CONFIG['min_samples']} minimum"
         })
     
     try:
@@ -555,27 +2627,25 @@ def save_captured_faces():
                 'success': False,
                 'message': 'Failed to insert student into database'
             })
-        
-        # Create labels array
-        labels = [student_id] * len(captured_faces)
+        stats_cache.adjust('total_students', 1)
         
         # Save face data to database
-        if not save_face_data(student_id, captured_faces, labels):
+        if not save_face_data(student_id, captured_faces):
             return jsonify({
                 'success': False,
                 'message': 'Failed to save face data to database'
             })
+        stats_cache.adjust('trained_count', 1)
         
-        # Save images to folder for backup
-        student_folder = os.path.join("StudentImages", student_id)
-        os.makedirs(student_folder, exist_ok=True)
+        # Save images to folder for backup (written in the background)
+        backup_writer.submit(student_id, captured_faces)
         
-        for idx, face_img in enumerate(captured_faces):
-            img_path = os.path.join(student_folder, f"face_{idx+1}.jpg")
-            cv2.imwrite(img_path, face_img)
+        # New or re-registered students must not be served stale details
+        invalidate_student_directory()
         
-        # -------- CHANGED: Clear session but don't reset globals yet --------
+        # Registration done: release this desk's capture buffer
         session.pop('registering_student', None)
+        discard_capture_session(session.pop('capture_session_id', None))
         
         return jsonify({
             'success': True,
@@ -592,52 +2662,38 @@ def save_captured_faces():
 @app.route('/train')
 def train_page():
     """Model training page"""
-    trained_count = get_trained_students_count()
-    total_students = len(get_all_students())
+    counts = stats_cache.get()
     return render_template('train.html', 
-                         trained_count=trained_count,
-                         total_students=total_students)
+                         trained_count=counts['trained_count'],
+                         total_students=counts['total_students'])
 
 @app.route('/train_model', methods=['POST'])
 def train_model():
-    """Train the face recognition model"""
-    try:
-        faces, ids, student_map = get_all_face_data()
-        
-        if len(faces) == 0:
-            return jsonify({'success': False, 'message': 'No training data found! Please register students first.'})
-        
-        recognizer = cv2.face.LBPHFaceRecognizer_create()
-        recognizer.train(faces, np.array(ids))
-        
-        os.makedirs("TrainingModel", exist_ok=True)
-        recognizer.save("TrainingModel/BUBTModel.yml")
-        
-        with open("TrainingModel/student_map.pkl", "wb") as f:
-            pickle.dump(student_map, f)
-        
-        trained_count = get_trained_students_count()
-        
-        # Reload the model
-        initialize_face_recognition()
-        
-        return jsonify({
-            'success': True, 
-            'message': f'Model trained successfully! Trained {trained_count} students with {len(faces)} samples.'
-        })
-        
-    except Exception as e:
-        return jsonify({'success': False, 'message': f'Error training model: {str(e)}'})
+    """Start training the face recognition model in the background"""
+    full_retrain = request.form.get('full_retrain', 'false').lower() in ('1', 'true', 'on')
+    job = start_training_job(full_retrain=full_retrain)
+    return jsonify({'success': True, 'job_id': job['job_id'], 'message': job['message']})
+
+@app.route('/train_status/<job_id>')
+def train_status(job_id):
+    """Report phase and sample counts for a training job"""
+    job = training_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Unknown training job'}), 404
+    return jsonify(dict(job, success=True))
 
 @app.route('/attendance')
 def attendance_page():
     """Attendance marking page"""
-    return render_template('attendance.html')
+    camera_id = request.args.get('camera')
+    if camera_id not in CAMERAS:
+        camera_id = next(iter(CAMERAS))
+    return render_template('attendance.html', cameras=CAMERAS, camera_id=camera_id)
 
 @app.route('/view_attendance')
 def view_attendance_page():
     """View attendance records page"""
-    today_attendance = get_today_attendance()
+    today_attendance = attendance_events.today_records()
     all_students = get_all_students()
     return render_template('view_attendance.html', 
                          attendance=today_attendance,
@@ -677,97 +2733,249 @@ def attendance_report():
                            selected_date=selected_date,
                            message=message)
 
+def parse_range_args(args):
+    """Read start/end/course/department from request args; raises ValueError on bad dates"""
+    end_date = datetime.strptime(args.get('end') or date.today().strftime('%Y-%m-%d'), '%Y-%m-%d').date()
+    start_date = datetime.strptime(args.get('start') or (end_date - timedelta(days=30)).strftime('%Y-%m-%d'),
+                                   '%Y-%m-%d').date()
+    if start_date > end_date:
+        raise ValueError("Start date is after end date")
+    return start_date, end_date, args.get('course') or None, args.get('department') or None
+
+@app.route('/attendance_range')
+def attendance_range_page():
+    """Attendance over a date range with course and department filters"""
+    courses, departments = get_report_filters()
+    try:
+        start_date, end_date, course_code, department = parse_range_args(request.args)
+    except ValueError as e:
+        today = date.today()
+        return render_template('attendance_range.html', rows=[], class_days=0, courses=courses,
+                               departments=departments, start=today - timedelta(days=30), end=today,
+                               course='', department='', message=f"Invalid date range: {e}",
+                               xlsx_available=openpyxl is not None)
+    
+    class_days, rows = get_attendance_range_report(start_date, end_date, course_code, department)
+    if rows is None:
+        message = "Could not load the report from the database."
+        rows = []
+    elif class_days == 0:
+        message = f"No classes recorded between {start_date} and {end_date}."
+    else:
+        average = sum(row['percentage'] for row in rows) / len(rows) if rows else 0
+        message = (f"{class_days} class days between {start_date} and {end_date}; "
+                   f"average attendance {average:.1f}% across {len(rows)} students.")
+    
+    return render_template('attendance_range.html', rows=rows, class_days=class_days,
+                           courses=courses, departments=departments,
+                           start=start_date, end=end_date,
+                           course=course_code or '', department=department or '',
+                           message=message, xlsx_available=openpyxl is not None)
+
+@app.route('/attendance_range_data')
+def attendance_range_data():
+    """JSON version of the date range report"""
+    try:
+        start_date, end_date, course_code, department = parse_range_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid date range: {e}'}), 400
+    class_days, rows = get_attendance_range_report(start_date, end_date, course_code, department)
+    if rows is None:
+        return jsonify({'error': 'Could not load the report from the database'}), 503
+    return jsonify({
+        'start': start_date.isoformat(),
+        'end': end_date.isoformat(),
+        'course': course_code,
+        'department': department,
+        'class_days': class_days,
+        'students': rows
+    })
+
+def csv_chunks(header, row_chunks):
+    """Encode rows as CSV text one chunk at a time; the header goes out first"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield buffer.getvalue()
+    for rows in row_chunks:
+        buffer.seek(0)
+        buffer.truncate(0)
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+def xlsx_chunks(header, row_chunks):
+    """Write rows to a write-only workbook spooled on disk, then send the file in blocks"""
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Attendance")
+    sheet.append(header)
+    for rows in row_chunks:
+        for row in rows:
+            sheet.append(list(row))
+    with tempfile.TemporaryFile() as spool:
+        workbook.save(spool)
+        spool.seek(0)
+        while True:
+            block = spool.read(64 * 1024)
+            if not block:
+                break
+            yield block
+
+def export_response(filename, header, row_chunks, file_format):
+    """Stream an export as CSV or XLSX; the query has already started, so errors surface before headers"""
+    if file_format == 'xlsx':
+        return Response(
+            xlsx_chunks(header, row_chunks),
+            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers={"Content-Disposition": f"attachment;filename={filename}.xlsx"}
+        )
+    return Response(
+        csv_chunks(header, row_chunks),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment;filename={filename}.csv"}
+    )
+
+def start_row_stream(row_chunks):
+    """Run the query up to its first chunk so connection errors can still become an error page"""
+    first = next(row_chunks, [])
+    return itertools.chain([first], row_chunks)
+
+def export_format():
+    """Requested export format; XLSX needs openpyxl"""
+    file_format = request.args.get('format', 'csv').lower()
+    if file_format not in ('csv', 'xlsx'):
+        raise ValueError(f"Unsupported format: {file_format}")
+    if file_format == 'xlsx' and openpyxl is None:
+        raise ValueError("XLSX export needs openpyxl (pip install openpyxl)")
+    return file_format
+
 @app.route('/download_csv/<date_str>')
 def download_report(date_str):
-    """Route to generate and download the CSV report."""
+    """Route to generate and download the report for one date, streamed as it is read."""
     try:
         datetime.strptime(date_str, '%Y-%m-%d')
-    except ValueError:
-        return "Invalid date format", 400
+        file_format = export_format()
+    except ValueError as e:
+        return f"Invalid request: {e}", 400
 
-    report_data = get_full_report_by_date(date_str)
-    
-    if not report_data:
+    if stats_cache.get()['total_students'] == 0:
         return f"No report data found for {date_str}", 404
 
-    # Create CSV in memory
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow(['Student ID', 'Name', 'Department', 'In Time', 'Out Time', 'Status'])
-    
-    # Write data
-    for student in report_data:
-        writer.writerow([
-            student['id'],
-            student['name'],
-            student['department'],
-            student['in_time'],
-            student['out_time'],
-            student['status']
-        ])
-    
-    # Prepare response
-    output.seek(0)
-    return Response(
-        output,
-        mimetype="text/csv",
-        headers={"Content-Disposition": f"attachment;filename=BUBT_Attendance_Report_{date_str}.csv"}
+    try:
+        rows = start_row_stream(stream_query_rows(DAILY_REPORT_QUERY, (date_str,)))
+    except Error as e:
+        print(f"Error exporting report: {e}")
+        return "Could not read the report from the database", 503
+
+    def report_rows():
+        for chunk in rows:
+            yield [
+                [student['id'], student['name'], student['department'],
+                 student['in_time'], student['out_time'], student['status']]
+                for student in map(format_report_row, chunk)
+            ]
+
+    return export_response(
+        f"BUBT_Attendance_Report_{date_str}",
+        ['Student ID', 'Name', 'Department', 'In Time', 'Out Time', 'Status'],
+        report_rows(),
+        file_format
+    )
+
+@app.route('/export_range')
+def export_range():
+    """Download every daily attendance row in a date range, streamed as it is read"""
+    try:
+        start_date, end_date, course_code, department = parse_range_args(request.args)
+        file_format = export_format()
+    except ValueError as e:
+        return f"Invalid request: {e}", 400
+
+    # Follows the attendance_daily primary key order, so MySQL streams it without sorting
+    query = """
+        SELECT d.date, d.course_code, s.student_id, s.name, s.department, d.in_time, d.out_time
+        FROM attendance_daily d
+        JOIN students s ON s.student_id = d.student_id
+        WHERE d.date BETWEEN %s AND %s
+    """
+    params = [start_date, end_date]
+    if course_code:
+        query += " AND d.course_code = %s"
+        params.append(course_code)
+    if department:
+        query += " AND s.department = %s"
+        params.append(department)
+    query += " ORDER BY d.date, d.course_code, s.student_id"
+
+    try:
+        rows = start_row_stream(stream_query_rows(query, tuple(params)))
+    except Error as e:
+        print(f"Error exporting attendance range: {e}")
+        return "Could not read attendance from the database", 503
+
+    def range_rows():
+        for chunk in rows:
+            yield [
+                [day.strftime('%Y-%m-%d'), course, student_id, name, dept,
+                 format_time_value(in_time), format_time_value(out_time)]
+                for day, course, student_id, name, dept, in_time, out_time in chunk
+            ]
+
+    return export_response(
+        f"BUBT_Attendance_{start_date}_to_{end_date}",
+        ['Date', 'Course', 'Student ID', 'Name', 'Department', 'In Time', 'Out Time'],
+        range_rows(),
+        file_format
     )
 
 # ---------------- Data Cleaning Routes ----------------
 @app.route('/admin')
 def admin_page():
     """Admin page for data management"""
-    total_students = len(get_all_students())
-    trained_count = get_trained_students_count()
-    today_attendance = get_today_attendance()
+    counts = stats_cache.get()
     
     return render_template('admin.html',
-                         total_students=total_students,
-                         trained_count=trained_count,
-                         attendance_count=len(today_attendance))
+                         total_students=counts['total_students'],
+                         trained_count=counts['trained_count'],
+                         attendance_count=attendance_events.today_count())
 
 @app.route('/clear_all_data', methods=['POST'])
 def clear_all_data():
     """Clear all data from the system"""
     try:
-        connection = create_connection()
-        if connection:
-            cursor = connection.cursor()
-            
-            # Clear all tables
-            cursor.execute("DELETE FROM attendance")
-            cursor.execute("DELETE FROM unknown_faces")
-            cursor.execute("DELETE FROM students")
-            cursor.execute("DELETE FROM courses")
-            
-            connection.commit()
-            cursor.close()
-            connection.close()
-            
-            # Clear training model files
-            if os.path.exists("TrainingModel/BUBTModel.yml"):
-                os.remove("TrainingModel/BUBTModel.yml")
-            if os.path.exists("TrainingModel/student_map.pkl"):
-                os.remove("TrainingModel/student_map.pkl")
-            
-            # Clear directories
-            if os.path.exists("StudentImages"):
-                shutil.rmtree("StudentImages")
-                os.makedirs("StudentImages", exist_ok=True)
-            
-            if os.path.exists("UnknownFaces"):
-                shutil.rmtree("UnknownFaces")
-                os.makedirs("UnknownFaces", exist_ok=True)
-            
-            # Reset face recognition
-            global recognizer, id_to_student
-            recognizer = None
-            id_to_student = {}
-            
-            return jsonify({'success': True, 'message': 'All system data cleared successfully'})
+        # Clear all tables
+        execute_admin_statements([
+            "DELETE FROM attendance",
+            "DELETE FROM attendance_daily",
+            "DELETE FROM unknown_faces",
+            "DELETE FROM student_faces",
+            "DELETE FROM students",
+            "DELETE FROM courses"
+        ])
+        attendance_events.reset()
+        stats_cache.invalidate()
+        
+        # Clear training model files
+        if os.path.exists("TrainingModel/BUBTModel.yml"):
+            os.remove("TrainingModel/BUBTModel.yml")
+        if os.path.exists("TrainingModel/student_map.pkl"):
+            os.remove("TrainingModel/student_map.pkl")
+        if os.path.exists("TrainingModel/model_manifest.pkl"):
+            os.remove("TrainingModel/model_manifest.pkl")
+        
+        # Clear directories
+        backup_writer.cancel_pending()
+        if os.path.exists("StudentImages"):
+            shutil.rmtree("StudentImages")
+            os.makedirs("StudentImages", exist_ok=True)
+        
+        if os.path.exists("UnknownFaces"):
+            shutil.rmtree("UnknownFaces")
+            os.makedirs("UnknownFaces", exist_ok=True)
+        
+        # Reset face recognition
+        activate_recognition_model(None, {})
+        
+        return jsonify({'success': True, 'message': 'All system data cleared successfully'})
     except Error as e:
         print(f"Error clearing all data: {e}")
         return jsonify({'success': False, 'message': f'Error clearing data: {e}'})
@@ -776,34 +2984,28 @@ def clear_all_data():
 def clear_students_only():
     """Clear only student data but keep attendance records"""
     try:
-        connection = create_connection()
-        if connection:
-            cursor = connection.cursor()
-            
-            # Clear students table
-            cursor.execute("DELETE FROM students")
-            
-            connection.commit()
-            cursor.close()
-            connection.close()
-            
-            # Clear training model files
-            if os.path.exists("TrainingModel/BUBTModel.yml"):
-                os.remove("TrainingModel/BUBTModel.yml")
-            if os.path.exists("TrainingModel/student_map.pkl"):
-                os.remove("TrainingModel/student_map.pkl")
-            
-            # Clear StudentImages directory
-            if os.path.exists("StudentImages"):
-                shutil.rmtree("StudentImages")
-                os.makedirs("StudentImages", exist_ok=True)
-            
-            # Reset face recognition
-            global recognizer, id_to_student
-            recognizer = None
-            id_to_student = {}
-            
-            return jsonify({'success': True, 'message': 'All student data cleared successfully'})
+        # Clear students table
+        execute_admin_statements(["DELETE FROM student_faces", "DELETE FROM students"])
+        stats_cache.invalidate()
+        
+        # Clear training model files
+        if os.path.exists("TrainingModel/BUBTModel.yml"):
+            os.remove("TrainingModel/BUBTModel.yml")
+        if os.path.exists("TrainingModel/student_map.pkl"):
+            os.remove("TrainingModel/student_map.pkl")
+        if os.path.exists("TrainingModel/model_manifest.pkl"):
+            os.remove("TrainingModel/model_manifest.pkl")
+        
+        # Clear StudentImages directory
+        backup_writer.cancel_pending()
+        if os.path.exists("StudentImages"):
+            shutil.rmtree("StudentImages")
+            os.makedirs("StudentImages", exist_ok=True)
+        
+        # Reset face recognition
+        activate_recognition_model(None, {})
+        
+        return jsonify({'success': True, 'message': 'All student data cleared successfully'})
     except Error as e:
         print(f"Error clearing students: {e}")
         return jsonify({'success': False, 'message': f'Error clearing students: {e}'})
@@ -812,98 +3014,149 @@ def clear_students_only():
 def clear_attendance_only():
     """Clear only attendance records"""
     try:
-        connection = create_connection()
-        if connection:
-            cursor = connection.cursor()
-            
-            # Clear attendance table
-            cursor.execute("DELETE FROM attendance")
-            
-            connection.commit()
-            cursor.close()
-            connection.close()
-            
-            return jsonify({'success': True, 'message': 'All attendance records cleared successfully'})
+        # Clear attendance table
+        execute_admin_statements(["DELETE FROM attendance", "DELETE FROM attendance_daily"])
+        attendance_events.reset()
+        
+        return jsonify({'success': True, 'message': 'All attendance records cleared successfully'})
     except Error as e:
         print(f"Error clearing attendance: {e}")
         return jsonify({'success': False, 'message': f'Error clearing attendance: {e}'})
 
+@app.route('/migrate_face_data', methods=['POST'])
+def migrate_face_data_route():
+    """Convert legacy pickled face data to the compact storage format"""
+    migrated = migrate_face_data()
+    if migrated is None:
+        return jsonify({'success': False, 'message': 'Error migrating face data'})
+    return jsonify({'success': True, 'message': f'Migrated face data for {migrated} students'})
+
+@app.route('/unknown_faces_stats')
+def unknown_faces_stats():
+    """Unknown face recorder counters and number of stored crops"""
+    stats = unknown_face_recorder.get_stats()
+    stats['stored'] = len(os.listdir("UnknownFaces")) if os.path.exists("UnknownFaces") else 0
+    return jsonify(stats)
+
+@app.route('/backup_status')
+def backup_status():
+    """Pending and completed StudentImages backup writes"""
+    return jsonify(backup_writer.get_status())
+
+@app.route('/attendance_writer_stats')
+def attendance_writer_stats():
+    """Write-behind attendance queue and flush statistics"""
+    stats = attendance_writer.get_stats()
+    stats['live_events'] = attendance_events.get_stats()
+    return jsonify(stats)
+
+@app.route('/pipeline_stats')
+def pipeline_stats():
+    """Per-camera worker state with stage latency and dropped-frame counters"""
+    return jsonify({
+        'pipelines': camera_manager.get_stats(),
+        'cameras': camera_registry.get_stats()
+    })
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint: this process's metrics plus each camera worker's"""
+    return Response(metrics.REGISTRY.render(camera_manager.metric_sources()),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/db_pool_stats')
+def db_pool_stats():
+    """Connection pool usage, including borrow wait times for sizing"""
+    return jsonify(get_db_pool().get_stats())
+
+@app.route('/db_diagnostics')
+def db_diagnostics():
+    """Query plans for the hot queries, table sizes and indexes"""
+    diagnostics = explain_queries()
+    if diagnostics is None:
+        return jsonify({'error': 'Could not connect to database'}), 503
+    return jsonify(diagnostics)
+
 @app.route('/video_feed')
 def video_feed():
     """Video streaming route for face capture"""
-    return Response(generate_frames(), 
+    capture = get_capture_session(session.get('capture_session_id'))
+    return Response(generate_frames(capture), 
                    mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/attendance_feed')
-def attendance_feed():
+@app.route('/attendance_feed/<camera_id>')
+def attendance_feed(camera_id=None):
     """Video streaming route for attendance marking"""
-    return Response(generate_attendance_frames(), 
+    return Response(generate_attendance_frames(camera_id or next(iter(CAMERAS))), 
                    mimetype='multipart/x-mixed-replace; boundary=frame')
 
-def generate_frames():
+def generate_frames(capture):
     """Generate frames for face capture"""
-    global capture_complete, captured_faces, capture_in_progress
-    
     print("\n=== GENERATE_FRAMES STARTED ===")
     
-    if not capture_in_progress:
+    if capture is None or not capture.in_progress:
         print("Capture not in progress, returning...")
         return
     
-    camera = cv2.VideoCapture(0)
-    if not camera.isOpened():
-        print("Error: Could not open camera")
-        capture_complete = True
-        capture_in_progress = False
+    # A classroom camera worker on the same device would fight over it; pause it meanwhile
+    camera_manager.hold_source(capture.camera_index)
+    camera = camera_registry.acquire(capture.camera_index)
+    if camera is None:
+        camera_manager.release_source(capture.camera_index)
+        capture.complete = True
+        capture.in_progress = False
         return
     
     print("Camera opened successfully")
     
-    # Set camera properties
-    camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-    
-    face_detector = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    face_detector = build_face_detector(CAPTURE_CAMERA_SETUP, scale_factor=1.1)
+    # Only sufficiently different frames become samples, so fewer, more varied images are stored
+    selector = SampleSelector(target_samples=CAPTURE_CONFIG['target_samples'],
+                              min_difference=CAPTURE_CONFIG['min_difference'])
+    target = CAPTURE_CONFIG['target_samples']
     sample_num = 0
     frame_count = 0
     
     print("Starting face capture loop...")
     
+    last_seq = 0
+    
     try:
-        while sample_num < 200 and capture_in_progress:
-            success, frame = camera.read()
-            if not success:
+        while sample_num < target and capture.in_progress and frame_count < CAPTURE_CONFIG['max_frames']:
+            last_seq, frame = camera.read(last_seq)
+            if last_seq is None:
                 print("Failed to read frame from camera")
                 break
+            if frame is None:
+                continue
             
+            # The camera frame is shared; draw on a private copy
+            frame = frame.copy()
             frame_count += 1
             gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
             
             # Detect faces
-            faces = face_detector.detectMultiScale(
-                gray, 
-                scaleFactor=1.1, 
-                minNeighbors=5, 
-                minSize=(30, 30)
-            )
+            faces = face_detector.detect(gray)
             
             # Process detected faces
             for (x, y, w, h) in faces:
                 cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
                 
-                # Capture face (every frame when face is detected)
-                if sample_num < 200:
-                    sample_num += 1
+                # Capture face when it differs enough from the samples kept so far
+                if sample_num < target:
                     face_roi = gray[y:y+h, x:x+w]
                     
                     # Resize to standard size
-                    face_roi = cv2.resize(face_roi, (200, 200))
-                    captured_faces.append(face_roi)
-                    
-                    print(f"✓ Captured face {sample_num}/200")
+                    face_roi = cv2.resize(face_roi, FACE_SIZE)
+                    if selector.offer(face_roi):
+                        sample_num += 1
+                        capture.faces.append(face_roi)
+                        capture.touch()
+                        print(f"✓ Captured face {sample_num}/{target}")
                 
                 # Display counter on frame
-                cv2.putText(frame, f"Face {sample_num}/200", (x, y-10), 
+                cv2.putText(frame, f"Face {sample_num}/{target}", (x, y-10), 
                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
             
             # Display status messages
@@ -911,10 +3164,10 @@ def generate_frames():
                 cv2.putText(frame, "No face detected - Position face in camera", (10, 30), 
                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
             else:
-                cv2.putText(frame, "Face detected - Keep looking at camera", (10, 30), 
+                cv2.putText(frame, "Face detected - Slowly turn and tilt your head", (10, 30), 
                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
             
-            cv2.putText(frame, f"Captured: {sample_num}/200 faces", (10, 60), 
+            cv2.putText(frame, f"Captured: {sample_num}/{target} faces", (10, 60), 
                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
             
             # Encode and yield frame
@@ -928,106 +3181,78 @@ def generate_frames():
             yield (b'--frame\r\n'
                    b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
         
-        print(f"\nCapture completed: {sample_num} faces captured")
-        print(f"Total faces in memory: {len(captured_faces)}")
+        print(f"\nCapture completed: {sample_num} faces captured ({selector.rejected} near-duplicates skipped)")
+        print(f"Total faces in memory: {len(capture.faces)}")
         
     except Exception as e:
         print(f"ERROR in generate_frames: {str(e)}")
         import traceback
         traceback.print_exc()
     finally:
-        camera.release()
-        capture_in_progress = False
-        capture_complete = True
+        camera_registry.release(camera)
+        camera_manager.release_source(capture.camera_index)
+        capture.in_progress = False
+        capture.complete = True
         print("Camera released")
-        print(f"Final state: complete={capture_complete}, in_progress={capture_in_progress}")
+        print(f"Final state [{capture.session_id}]: complete={capture.complete}, in_progress={capture.in_progress}")
+
 
+def build_face_detector(camera_setup, scale_factor=1.2, min_neighbors=5):
+    """Create a FaceDetector sized for the given camera setup"""
+    min_size, max_size = face_size_limits(**camera_setup)
+    return FaceDetector(faceCascadePath, scale_factor=scale_factor, min_neighbors=min_neighbors,
+                        min_size=min_size, max_size=max_size, **DETECTION_CONFIG)
 
-def generate_attendance_frames():
+def generate_attendance_frames(camera_id):
     """Generate frames for attendance marking"""
     # -------- CHANGED: Removed tracked_today set to allow multiple attendance marks --------
     # Now it will always update the time when a face is recognized
-    
-    camera = cv2.VideoCapture(0)
-    if not camera.isOpened():
-        print("Error: Could not open camera")
+    # Every viewer shares the camera's worker process; slow viewers skip frames
+    worker = camera_manager.acquire(camera_id)
+    if worker is None:
         return
     
-    while True:
-        success, frame = camera.read()
-        if not success:
-            break
-        
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces_detected = faceCascade.detectMultiScale(gray, 1.2, 5)
-        
-        for (x, y, w, h) in faces_detected:
-            cv2.rectangle(frame, (x, y), (x+w, y+h), (46, 125, 50), 3)
-            
-            if recognizer:
-                label_id, conf = recognizer.predict(gray[y:y+h, x:x+w])
-                confidence_percent = round(100 - conf)
-                
-                if conf < 60 and label_id in id_to_student:
-                    student_id = id_to_student[label_id]
-                    name, department = get_student_name(student_id)
-                    
-                    if name:
-                        ts = time.time()
-                        date_str = datetime.fromtimestamp(ts).strftime('%Y-%m-%d')
-                        time_str = datetime.fromtimestamp(ts).strftime('%H:%M:%S')
-                        
-                        # -------- CHANGED: Always insert/update attendance to track both in-time and out-time --------
-                        if insert_attendance(student_id, name, department, date_str, time_str):
-                            print(f"✓ Attendance Updated: {student_id} - {name} ({department}) at {time_str}")
-                        
-                        display_text = f"{name}"
-                        display_text2 = f"ID: {student_id} | {department}"
-                        color = (46, 125, 50)
-                    else:
-                        display_text = "Unknown Person"
-                        display_text2 = "Not Registered"
-                        color = (244, 67, 54)
-                else:
-                    display_text = "Unknown Person"
-                    display_text2 = "Not Registered"
-                    color = (244, 67, 54)
-                    
-                    if conf > 80:
-                        noOfFile = len(os.listdir("UnknownFaces")) + 1
-                        unknown_path = f"UnknownFaces/Unknown_{noOfFile}.jpg"
-                        cv2.imwrite(unknown_path, frame[y:y+h, x:x+w])
-                        log_unknown_face(unknown_path)
-                
-                cv2.putText(frame, display_text, (x+5, y-30), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
-                cv2.putText(frame, display_text2, (x+5, y-10), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-                cv2.putText(frame, f"Confidence: {confidence_percent}%", (x+5, y+h+25), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2)
-        
-        cv2.putText(frame, "BUBT Attendance System - Live", (10, 30), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
-        
-        ret, buffer = cv2.imencode('.jpg', frame)
-        frame = buffer.tobytes()
-        
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-    
-    camera.release()
+    try:
+        while True:
+            for frame in worker.broadcaster.subscribe():
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+            if not camera_manager.is_paused(worker) and not worker.running:
+                break
+            # Keep the viewer connected while registration borrows the camera
+            while camera_manager.is_paused(worker):
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + paused_frame_jpeg() + b'\r\n')
+                time.sleep(1.0)
+    finally:
+        camera_manager.release(worker)
+
+@functools.lru_cache(maxsize=1)
+def paused_frame_jpeg():
+    """Placeholder shown on the attendance feed while its camera is used for registration"""
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    cv2.putText(frame, "Camera in use for student registration", (60, 230),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+    cv2.putText(frame, "Attendance resumes automatically", (120, 270),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (200, 200, 200), 2)
+    return cv2.imencode('.jpg', frame)[1].tobytes()
 
 
+@app.route('/attendance_events')
+def attendance_events_stream():
+    """Server-Sent Events: a snapshot of today on connect, then one event per committed marking"""
+    subscriber = attendance_events.subscribe()
+    if subscriber is None:
+        return jsonify({'error': 'Too many live attendance viewers'}), 503
+    return Response(attendance_events.stream(subscriber),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/get_attendance_stats')
 def get_attendance_stats():
     """Get current attendance statistics"""
-    today_attendance = get_today_attendance()
-    return jsonify({
-        'count': len(today_attendance),
-        'attendance': [{'id': a[0], 'name': a[1], 'dept': a[2], 'time': a[3]} 
-                      for a in today_attendance]
-    })
+    return jsonify(attendance_events.snapshot())
 
 if __name__ == '__main__':
+    start_app()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,263 @@
+"""Offline attendance from recorded lecture videos and image folders.
+
+Runs the same detection and LBPH recognition as the live attendance page
+over recordings, split into segments across a process pool, and writes
+one deduplicated attendance row per student and day (first and last time
+seen) through insert_attendance_batch.
+
+    python batch_attendance.py lecture1.mp4 lecture2.mp4 --course CSE101
+    python batch_attendance.py snapshots/ --workers 4 --dry-run
+
+Workers only import vision.py and OpenCV; the Flask app (and MySQL) is
+loaded in the parent process when the results are written.
+"""
+import argparse
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import cv2
+
+from vision import (BatchLBPHMatcher, FaceDetector, FaceTracker, face_size_limits, identify_faces,
+                    MATCH_DISTANCE)
+
+MODEL_PATH = "TrainingModel/BUBTModel.yml"
+STUDENT_MAP_PATH = "TrainingModel/student_map.pkl"
+CASCADE_FILE = "haarcascade_frontalface_default.xml"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# Set per worker process by init_worker
+worker_model = None
+worker_settings = None
+
+
+def find_cascade():
+    if os.path.exists(CASCADE_FILE):
+        return CASCADE_FILE
+    return cv2.data.haarcascades + CASCADE_FILE
+
+
+def init_worker(settings):
+    """Load the model once per worker process"""
+    global worker_model, worker_settings
+    # One OpenCV thread per process; the pool already uses every core
+    cv2.setNumThreads(1)
+    worker_model = cv2.face.LBPHFaceRecognizer_create()
+    worker_model.read(MODEL_PATH)
+    if settings['backend'] == 'batch':
+        worker_model = BatchLBPHMatcher.from_lbph(worker_model)
+    worker_settings = settings
+
+
+def build_detector(frame_width):
+    """Face detector sized for this recording's resolution"""
+    min_size, max_size = face_size_limits(frame_width,
+                                          horizontal_fov=worker_settings['fov'],
+                                          min_distance=worker_settings['min_distance'],
+                                          max_distance=worker_settings['max_distance'])
+    return FaceDetector(worker_settings['cascade_path'], mode='downscale',
+                        min_size=min_size, max_size=max_size)
+
+
+def recognize_frame(frame, detector, tracker, sightings, seen_at):
+    """Record every confidently recognized label in sightings[(label, day)] as [first, last] seen"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    boxes = detector.detect(gray)
+    faces = 0
+    for _, label, distance, _ in identify_faces(gray, boxes, worker_model, tracker):
+        faces += 1
+        if distance < MATCH_DISTANCE:
+            key = (label, seen_at.date())
+            seen = sightings.get(key)
+            if seen is None:
+                sightings[key] = [seen_at, seen_at]
+            else:
+                seen[0] = min(seen[0], seen_at)
+                seen[1] = max(seen[1], seen_at)
+    return faces
+
+
+def process_video_segment(task):
+    """Recognize faces in frames [start_frame, end_frame) of a video, every frame_step-th frame"""
+    path, start_frame, end_frame, fps, started_at = task
+    capture = cv2.VideoCapture(path)
+    capture.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    step = worker_settings['frame_step']
+    tracker = FaceTracker()
+    detector = None
+    sightings = {}
+    frames = faces = 0
+    try:
+        for frame_no in range(start_frame, end_frame):
+            # grab() skips decoding the frames in between
+            if not capture.grab():
+                break
+            if (frame_no - start_frame) % step:
+                continue
+            ok, frame = capture.retrieve()
+            if not ok:
+                break
+            if detector is None:
+                detector = build_detector(frame.shape[1])
+            seen_at = started_at + timedelta(seconds=frame_no / fps)
+            faces += recognize_frame(frame, detector, tracker, sightings, seen_at)
+            frames += 1
+    finally:
+        capture.release()
+    return sightings, frames, faces
+
+
+def process_image_batch(task):
+    """Recognize faces in a list of still images, timestamped by file modification time"""
+    paths = task
+    sightings = {}
+    frames = faces = 0
+    detectors = {}
+    for path in paths:
+        frame = cv2.imread(path)
+        if frame is None:
+            print(f"Skipping unreadable image: {path}")
+            continue
+        width = frame.shape[1]
+        if width not in detectors:
+            detectors[width] = build_detector(width)
+        seen_at = datetime.fromtimestamp(os.path.getmtime(path))
+        # Stills are unrelated frames, so there is nothing to track between them
+        faces += recognize_frame(frame, detectors[width], None, sightings, seen_at)
+        frames += 1
+    return sightings, frames, faces
+
+
+def plan_video(path, segment_seconds, start):
+    """Split a video into (path, start_frame, end_frame, fps, started_at) segments"""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        print(f"Skipping unreadable video: {path}")
+        return []
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+    if total <= 0:
+        print(f"Skipping video with unknown length: {path}")
+        return []
+    # Without --start, assume the recording ended when the file was last written
+    started_at = start or datetime.fromtimestamp(os.path.getmtime(path)) - timedelta(seconds=total / fps)
+    segment = max(1, int(segment_seconds * fps))
+    return [(path, first, min(first + segment, total), fps, started_at)
+            for first in range(0, total, segment)]
+
+
+def plan_images(directory, batch_size):
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                   if name.lower().endswith(IMAGE_EXTENSIONS))
+    return [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+
+
+def merge_sightings(total, sightings):
+    """Fold one segment's sightings into the run; keys include the day, as a run may span several"""
+    for key, (first, last) in sightings.items():
+        seen = total.get(key)
+        if seen is None:
+            total[key] = [first, last]
+        else:
+            seen[0] = min(seen[0], first)
+            seen[1] = max(seen[1], last)
+
+
+def write_attendance(total, student_map, course_code):
+    """Resolve labels to students and upsert one attendance row per student and day"""
+    import app  # database helpers only (importing app starts nothing); kept out of the worker processes
+
+    label_to_student = {label: student_id for student_id, label in student_map.items()}
+    student_ids = {label_to_student[label] for label, _ in total if label in label_to_student}
+    directory = app.get_student_directory(list(student_ids))
+
+    records = []
+    for (label, _), (first, last) in sorted(total.items(), key=lambda item: item[1][0]):
+        student_id = label_to_student.get(label)
+        if student_id not in directory:
+            continue
+        name, department = directory[student_id]
+        records.append((student_id, name, department, course_code, first, last))
+    if not app.insert_attendance_batch(records):
+        raise RuntimeError("Writing attendance to the database failed")
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Take attendance from recorded videos or image folders")
+    parser.add_argument('inputs', nargs='+', help="video files and/or directories of images")
+    parser.add_argument('--course', default="", help="course code to record attendance under")
+    parser.add_argument('--start', help="recording start time (YYYY-MM-DD HH:MM:SS) for all videos")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--segment-seconds', type=float, default=60.0,
+                        help="length of the video slice handed to one worker")
+    parser.add_argument('--frame-step', type=int, default=5, help="recognize every Nth video frame")
+    parser.add_argument('--image-batch', type=int, default=50, help="images handed to one worker")
+    parser.add_argument('--fov', type=float, default=60.0, help="camera horizontal field of view (degrees)")
+    parser.add_argument('--min-distance', type=float, default=0.5, help="nearest face distance (metres)")
+    parser.add_argument('--max-distance', type=float, default=3.0, help="farthest face distance (metres)")
+    parser.add_argument('--backend', choices=('lbph', 'batch'), default='lbph',
+                        help="recognizer: OpenCV LBPH per face, or all faces of a frame in one batch")
+    parser.add_argument('--dry-run', action='store_true', help="report matches without writing attendance")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(MODEL_PATH) or not os.path.exists(STUDENT_MAP_PATH):
+        print("No trained model found. Train the model first.")
+        return 1
+    with open(STUDENT_MAP_PATH, "rb") as f:
+        student_map = pickle.load(f)
+    start = datetime.strptime(args.start, '%Y-%m-%d %H:%M:%S') if args.start else None
+
+    tasks = []
+    for path in args.inputs:
+        if os.path.isdir(path):
+            tasks += [(process_image_batch, batch) for batch in plan_images(path, args.image_batch)]
+        else:
+            tasks += [(process_video_segment, segment)
+                      for segment in plan_video(path, args.segment_seconds, start)]
+    if not tasks:
+        print("Nothing to process.")
+        return 1
+
+    settings = {
+        'cascade_path': find_cascade(),
+        'backend': args.backend,
+        'frame_step': max(1, args.frame_step),
+        'fov': args.fov,
+        'min_distance': args.min_distance,
+        'max_distance': args.max_distance
+    }
+    total = {}
+    frames = faces = 0
+    started = time.monotonic()
+    print(f"Processing {len(tasks)} segments on {args.workers} workers...")
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(settings,)) as pool:
+        futures = [pool.submit(func, task) for func, task in tasks]
+        for done, future in enumerate(as_completed(futures), start=1):
+            sightings, segment_frames, segment_faces = future.result()
+            merge_sightings(total, sightings)
+            frames += segment_frames
+            faces += segment_faces
+            print(f"  {done}/{len(tasks)} segments, {frames} frames, {len(total)} students")
+    elapsed = time.monotonic() - started
+
+    if args.dry_run:
+        label_to_student = {label: student_id for student_id, label in student_map.items()}
+        for (label, day), (first, last) in sorted(total.items(), key=lambda item: item[1][0]):
+            print(f"{day} {label_to_student.get(label, f'label {label}')}: "
+                  f"{first.strftime('%H:%M:%S')} - {last.strftime('%H:%M:%S')}")
+    else:
+        records = write_attendance(total, student_map, args.course)
+        print(f"✓ Attendance written for {len(records)} student-days")
+
+    fps = frames / elapsed if elapsed > 0 else 0.0
+    print(f"✓ {frames} frames, {faces} faces in {elapsed:.1f}s ({fps:.1f} frames/s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
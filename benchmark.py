@@ -0,0 +1,494 @@
+"""End-to-end benchmarks for detection, training, recognition, attendance writes and reports.
+
+Enrolls synthetic students (or replays crops from StudentImages/) at each
+requested size, times every stage and prints latency percentiles and
+throughput as JSON, so runs can be compared over time. The live stage
+replays a classroom sequence through the camera workers' RecognitionLoop
+(ROI detection, face tracking, recognition) into an AttendanceWriter.
+
+    python benchmark.py                                  # 100, 1000, 10000 students on SQLite
+    python benchmark.py --sizes 100,1000 --output bench.json
+    python benchmark.py --backend mysql                  # uses the app's queries on a scratch database
+
+The SQLite backend runs the same statements rewritten for SQLite, in
+memory; the MySQL backend calls the app's own functions against
+DB_CONFIG with the database name replaced by --mysql-database.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sqlite3
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import cv2
+import numpy as np
+
+from vision import BatchLBPHMatcher, FaceDetector, FaceTracker, RecognitionLoop, face_size_limits
+
+FACE_SIZE = (200, 200)
+CASCADE_FILE = "haarcascade_frontalface_default.xml"
+
+
+def summarize(samples, units=None):
+    """Latency percentiles in ms and throughput for a list of durations in seconds
+
+    Throughput counts one unit per sample unless units (the total work done) is given.
+    """
+    if not samples:
+        return {'count': 0}
+    ms = np.asarray(samples) * 1000.0
+    total = float(np.sum(samples))
+    return {
+        'count': len(samples),
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'max_ms': round(float(ms.max()), 3),
+        'per_second': round((units or len(samples)) / total, 2) if total > 0 else None
+    }
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+
+# ---------------- Synthetic data ----------------
+def drawn_face(rng):
+    """A cartoon face the Haar cascade detects; feature placement and skin texture vary per call"""
+    face = np.full(FACE_SIZE, 40, dtype=np.float32)
+    c = FACE_SIZE[0] // 2
+    skin = np.zeros(FACE_SIZE, dtype=np.uint8)
+    cv2.ellipse(skin, (c, c + 5), (int(rng.integers(62, 76)), int(rng.integers(84, 94))), 0, 0, 360, 1, -1)
+    texture = cv2.resize(rng.normal(0, 1, (12, 12)).astype(np.float32), FACE_SIZE, interpolation=cv2.INTER_CUBIC)
+    face[skin > 0] = 180 + 25 * texture[skin > 0]
+    gap, eye_y = int(rng.integers(24, 36)), c - int(rng.integers(15, 26))
+    for ex in (c - gap, c + gap):
+        cv2.ellipse(face, (ex, eye_y), (int(rng.integers(12, 19)), int(rng.integers(6, 11))), 0, 0, 360, 60, -1)
+        cv2.line(face, (ex - 20, eye_y - int(rng.integers(18, 26))), (ex + 20, eye_y - int(rng.integers(18, 26))),
+                 70, 6)
+    cv2.line(face, (c, c - 10), (c + int(rng.integers(-4, 5)), c + int(rng.integers(20, 32))), 150, 5)
+    cv2.ellipse(face, (c, c + int(rng.integers(44, 58))), (int(rng.integers(20, 34)), int(rng.integers(6, 13))),
+                0, 0, 360, 90, -1)
+    return cv2.GaussianBlur(np.clip(face, 0, 255).astype(np.uint8), (7, 7), 0)
+
+
+def synthetic_faces(rng, students, samples):
+    """Per student, a distinct drawn face plus per-sample noise and shift.
+
+    Samples are 120-170 px, the size a classroom camera sees faces at, so
+    replaying them in live frames matches the enrolled appearance.
+    """
+    for label in range(students):
+        base = drawn_face(rng)
+        for _ in range(samples):
+            shift = np.float32([[1, 0, rng.integers(-6, 7)], [0, 1, rng.integers(-6, 7)]])
+            face = cv2.warpAffine(base, shift, FACE_SIZE, borderMode=cv2.BORDER_REFLECT)
+            size = int(rng.integers(120, 171))
+            face = cv2.resize(face, (size, size), interpolation=cv2.INTER_AREA)
+            noise = rng.normal(0, 8, face.shape)
+            yield label, np.clip(face + noise, 0, 255).astype(np.uint8)
+
+
+def stored_faces(directory, students, samples):
+    """Replay face crops saved under StudentImages/<student_id>/"""
+    folders = sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+    for label, folder in enumerate(folders[:students]):
+        names = sorted(os.listdir(os.path.join(directory, folder)))[:samples]
+        for name in names:
+            face = cv2.imread(os.path.join(directory, folder, name), cv2.IMREAD_GRAYSCALE)
+            if face is not None:
+                yield label, cv2.resize(face, FACE_SIZE)
+
+
+def replay_frames(rng, faces, frames, faces_per_frame, scene_length=25, width=640, height=480):
+    """A classroom sequence of 640x480 frames; returns [(frame, labels in the frame)].
+
+    faces is a list of (label, crop). Each scene puts faces_per_frame of
+    them in separate cells of a 3x2 grid, drifting a pixel or two per
+    frame so detection ROIs and tracks carry over; every scene_length
+    frames a new set of faces takes their place.
+    """
+    cell_w, cell_h = width // 3, height // 2
+    sequence = []
+    for start in range(0, frames, scene_length):
+        background = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (9, 9), 0)
+        people = []
+        for cell in rng.choice(6, min(faces_per_frame, 6), replace=False):
+            label, crop = faces[int(rng.integers(0, len(faces)))]
+            # face_size_limits() puts the largest classroom face at 177 px
+            size = min(crop.shape[0], 170)
+            x0, y0 = int(cell % 3) * cell_w, int(cell // 3) * cell_h
+            position = np.array([x0 + rng.integers(0, cell_w - size), y0 + rng.integers(0, cell_h - size)], float)
+            people.append((label, cv2.cvtColor(cv2.resize(crop, (size, size)), cv2.COLOR_GRAY2BGR),
+                           position, rng.uniform(-1.5, 1.5, 2), (x0, y0, x0 + cell_w - size, y0 + cell_h - size)))
+        for _ in range(min(scene_length, frames - start)):
+            frame = background.copy()
+            for label, face, position, velocity, (min_x, min_y, max_x, max_y) in people:
+                position += velocity
+                np.clip(position, (min_x, min_y), (max_x, max_y), out=position)
+                x, y = int(position[0]), int(position[1])
+                frame[y:y + face.shape[0], x:x + face.shape[1]] = face
+            sequence.append((frame, [person[0] for person in people]))
+    return sequence
+
+
+# ---------------- Database backends ----------------
+class SQLiteBackend:
+    """In-memory stand-in with the app's attendance schema and statements rewritten for SQLite"""
+
+    name = 'sqlite'
+
+    def __init__(self):
+        # The live stage writes from the AttendanceWriter's thread
+        self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE students (
+                student_id TEXT PRIMARY KEY, name TEXT NOT NULL, department TEXT,
+                is_trained INTEGER DEFAULT 0, created_at TEXT
+            );
+            CREATE TABLE attendance (
+                attendance_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                student_id TEXT NOT NULL, student_name TEXT NOT NULL, department TEXT,
+                course_code TEXT, date TEXT NOT NULL, time TEXT NOT NULL, timestamp TEXT,
+                UNIQUE (student_id, date, course_code)
+            );
+            CREATE INDEX idx_attendance_date_time ON attendance (date, time);
+            CREATE INDEX idx_attendance_date_student ON attendance (date, student_id, time, timestamp);
+            CREATE TABLE attendance_daily (
+                student_id TEXT NOT NULL, date TEXT NOT NULL, course_code TEXT NOT NULL DEFAULT '',
+                in_time TEXT NOT NULL, out_time TEXT NOT NULL,
+                PRIMARY KEY (date, course_code, student_id)
+            );
+            CREATE INDEX idx_daily_student ON attendance_daily (student_id, date, course_code);
+        """)
+
+    def reset(self, students):
+        self.connection.execute("DELETE FROM attendance")
+        self.connection.execute("DELETE FROM attendance_daily")
+        self.connection.execute("DELETE FROM students")
+        self.connection.executemany(
+            "INSERT INTO students (student_id, name, department, is_trained) VALUES (?, ?, ?, 1)",
+            [(student_id, name, dept) for student_id, name, dept in students]
+        )
+        self.connection.commit()
+
+    def insert_attendance_batch(self, records, raise_errors=False):
+        cursor = self.connection.cursor()
+        cursor.executemany("""
+            INSERT INTO attendance (student_id, student_name, department, course_code, date, time, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (student_id, date, course_code) DO UPDATE SET
+                time = MAX(time, excluded.time), timestamp = MIN(timestamp, excluded.timestamp)
+        """, [(student_id, name, dept, course, last.strftime('%Y-%m-%d'), last.strftime('%H:%M:%S'),
+               first.strftime('%Y-%m-%d %H:%M:%S'))
+              for student_id, name, dept, course, first, last in records])
+        cursor.executemany("""
+            INSERT INTO attendance_daily (student_id, date, course_code, in_time, out_time)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (date, course_code, student_id) DO UPDATE SET
+                in_time = MIN(in_time, excluded.in_time), out_time = MAX(out_time, excluded.out_time)
+        """, [(student_id, last.strftime('%Y-%m-%d'), course, first.strftime('%H:%M:%S'),
+               last.strftime('%H:%M:%S'))
+              for student_id, _, _, course, first, last in records])
+        self.connection.commit()
+        return True
+
+    def daily_report(self, day):
+        return self.connection.execute("""
+            SELECT s.student_id, s.name, s.department, T.in_time_dt, T.out_time_col
+            FROM students s
+            LEFT JOIN (
+                SELECT student_id, MIN(timestamp) AS in_time_dt, MAX(time) AS out_time_col
+                FROM attendance WHERE date = ? GROUP BY student_id
+            ) AS T ON s.student_id = T.student_id
+            ORDER BY s.student_id ASC
+        """, (day.strftime('%Y-%m-%d'),)).fetchall()
+
+    def range_report(self, start, end):
+        return self.connection.execute("""
+            SELECT s.student_id, s.name, s.department, COUNT(DISTINCT d.date)
+            FROM students s
+            LEFT JOIN attendance_daily d
+                ON d.student_id = s.student_id AND d.date BETWEEN ? AND ?
+            GROUP BY s.student_id, s.name, s.department
+            ORDER BY s.student_id ASC
+        """, (start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))).fetchall()
+
+
+class MySQLBackend:
+    """The app's own write and report functions, pointed at a scratch database"""
+
+    name = 'mysql'
+
+    def __init__(self, database):
+        import app  # helpers only; the app's start-up (and its database) is untouched on import
+        if database == app.DB_CONFIG['database']:
+            raise ValueError(f"Refusing to benchmark against the app's own database {database}")
+        # A copy, so every helper (pool, schema setup) only ever sees the scratch database
+        app.DB_CONFIG = dict(app.DB_CONFIG, database=database)
+        app.db_pool = None
+        if not app.initialize_database():
+            raise RuntimeError(f"Could not initialize MySQL database {database}")
+        self.app = app
+
+    def reset(self, students):
+        self.app.execute_admin_statements([
+            "DELETE FROM attendance", "DELETE FROM attendance_daily",
+            "DELETE FROM student_faces", "DELETE FROM students"
+        ])
+        connection = self.app.create_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.executemany(
+                "INSERT INTO students (student_id, name, department, is_trained) VALUES (%s, %s, %s, TRUE)",
+                list(students)
+            )
+            connection.commit()
+            cursor.close()
+        finally:
+            connection.close()
+
+    def insert_attendance_batch(self, records, raise_errors=False):
+        return self.app.insert_attendance_batch(records, raise_errors=raise_errors)
+
+    def daily_report(self, day):
+        return self.app.get_full_report_by_date(day.strftime('%Y-%m-%d'))
+
+    def range_report(self, start, end):
+        return self.app.get_attendance_range_report(start, end)[1]
+
+
+# ---------------- Stages ----------------
+def build_detector(mode):
+    cascade = CASCADE_FILE if os.path.exists(CASCADE_FILE) else cv2.data.haarcascades + CASCADE_FILE
+    min_size, max_size = face_size_limits(640, 60.0, 0.5, 3.0)
+    return FaceDetector(cascade, mode=mode, min_size=min_size, max_size=max_size)
+
+
+def bench_detection(sequence):
+    """Cascade latency per frame of a replayed sequence, in each FaceDetector mode"""
+    grays = [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame, _ in sequence]
+    expected = sum(len(labels) for _, labels in sequence) / len(sequence)
+    results = {}
+    for mode in ('full', 'downscale', 'roi'):
+        detector = build_detector(mode)
+        samples, found = [], 0
+        for gray in grays:
+            seconds, boxes = timed(detector.detect, gray)
+            samples.append(seconds)
+            found += len(boxes)
+        stats = detector.get_stats()
+        results[mode] = dict(summarize(samples), faces_expected_per_frame=round(expected, 2),
+                             faces_found_per_frame=round(found / len(grays), 2),
+                             full_scans=stats['full_scans'], roi_scans=stats['roi_scans'])
+    return results
+
+
+def bench_live(backend, model, names, sequence, recognizer):
+    """The camera workers' per-frame path on a replayed sequence, feeding an AttendanceWriter.
+
+    Frames go through RecognitionLoop one at a time (ROI detection, the face
+    tracker and recognition, drawing included); recognitions are coalesced
+    and written to the backend by the app's AttendanceWriter.
+    """
+    import app  # helpers only; importing doesn't start the app or touch its database
+    writer = app.AttendanceWriter(flush_interval=0.5, write_batch=backend.insert_attendance_batch)
+    labels_by_student = {student_id: label for label, (student_id, _, _) in names.items()}
+    counts = {'seen': 0, 'seen_correct': 0, 'unknown_reports': 0}
+    truth = []
+
+    def report(kind, *payload):
+        if kind == 'unknown':
+            counts['unknown_reports'] += 1
+            return
+        for student_id, name, department, seen_ts in payload[0]:
+            counts['seen'] += 1
+            counts['seen_correct'] += labels_by_student[student_id] in truth[-1]
+            writer.record(student_id, name, department, seen_at=datetime.fromtimestamp(seen_ts))
+
+    detector = build_detector('roi')
+    tracker = FaceTracker()
+    loop = RecognitionLoop(detector, tracker, "benchmark", report, backend=recognizer)
+    loop.use_model(model, names)
+    latencies = []
+    # The writer logs every row it writes; keep that out of the JSON on stdout
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        for frame, labels in sequence:
+            frame = frame.copy()
+            truth.append(set(labels))
+            seconds, _ = timed(loop, frame)
+            latencies.append(seconds)
+        writer.stop()
+    tracking, detection = tracker.get_stats(), detector.get_stats()
+    return dict(
+        summarize(latencies),
+        recognizer=recognizer,
+        faces_per_frame=round(sum(len(t) for t in truth) / len(truth), 2),
+        recognitions=counts['seen'],
+        recognition_precision=round(counts['seen_correct'] / counts['seen'], 3) if counts['seen'] else None,
+        unknown_reports=counts['unknown_reports'],
+        tracker_reuse_ratio=tracking['reuse_ratio'],
+        predictions=tracking['predictions'],
+        full_scans=detection['full_scans'],
+        roi_scans=detection['roi_scans'],
+        writer={key: round(writer.stats[key], 4) for key in
+                ('recognitions', 'flushes', 'rows_written', 'failed_flushes', 'last_flush_seconds')}
+    )
+
+
+def bench_students(backend, rng, students, samples, probes, days, student_images, faces_per_frame, frames,
+                   recognizer):
+    result = {'students': students, 'samples_per_student': samples}
+
+    source = stored_faces(student_images, students, samples) if student_images else \
+        synthetic_faces(rng, students, samples)
+    labels, faces = [], []
+    for label, face in source:
+        labels.append(label)
+        faces.append(face)
+    students = len(set(labels))
+    result['students'] = students
+
+    # Training: one full train, then one incremental update of 1% more students
+    model = cv2.face.LBPHFaceRecognizer_create()
+    seconds, _ = timed(model.train, faces, np.asarray(labels, dtype=np.int32))
+    result['train'] = {'seconds': round(seconds, 3), 'samples_per_second': round(len(faces) / seconds, 1)}
+    extra = max(1, students // 100)
+    new_labels, new_faces = zip(*((label + students, face) for label, face in synthetic_faces(rng, extra, samples)))
+    seconds, _ = timed(model.update, list(new_faces), np.asarray(new_labels, dtype=np.int32))
+    result['train_incremental'] = {'students': extra, 'seconds': round(seconds, 3)}
+
+    # Recognition: one LBPH predict per face box
+    hits, latencies = 0, []
+    for i in rng.integers(0, len(faces), probes):
+        seconds, (label, distance) = timed(model.predict, faces[int(i)])
+        latencies.append(seconds)
+        hits += label == labels[int(i)]
+    result['predict'] = dict(summarize(latencies), accuracy=round(hits / probes, 3))
+
+    # Per frame: OpenCV predict per face vs BatchLBPHMatcher on all faces at once,
+    # on crops resized to the face sizes a classroom camera produces
+    seconds, matcher = timed(BatchLBPHMatcher.from_lbph, model)
+    cv2_latencies, batch_latencies = [], []
+    agree, max_difference = 0, 0.0
+    for _ in range(max(1, probes // faces_per_frame)):
+        crops = [cv2.resize(faces[int(i)], (size, size)) for i, size in
+                 zip(rng.integers(0, len(faces), faces_per_frame), rng.integers(40, 150, faces_per_frame))]
+        started = time.perf_counter()
+        expected = [model.predict(crop) for crop in crops]
+        cv2_latencies.append(time.perf_counter() - started)
+        elapsed, predicted = timed(matcher.predict_batch, crops)
+        batch_latencies.append(elapsed)
+        for (label, distance), (batch_label, batch_distance) in zip(expected, predicted):
+            agree += label == batch_label
+            max_difference = max(max_difference, abs(distance - batch_distance))
+    batches = len(cv2_latencies)
+    result['predict_frame'] = {
+        'faces_per_frame': faces_per_frame,
+        'lbph': summarize(cv2_latencies),
+        'batch': summarize(batch_latencies),
+        'batch_load_seconds': round(seconds, 3),
+        'label_agreement': round(agree / (batches * faces_per_frame), 4),
+        'max_distance_difference': max_difference
+    }
+    del matcher
+
+    # Live path: replayed classroom frames through RecognitionLoop into an AttendanceWriter
+    roster = [(f"S{label:06d}", f"Student {label}", ("CSE", "EEE", "BBA")[label % 3]) for label in range(students)]
+    backend.reset(roster)
+    names = {label: roster[label] for label in range(students)}
+    sequence = replay_frames(rng, list(zip(labels, faces)), frames, faces_per_frame)
+    result['live'] = bench_live(backend, model, names, sequence, recognizer)
+    del faces, model, sequence
+
+    # Attendance writes: every student recognized once per day, flushed in writer-sized batches
+    backend.reset(roster)
+    batch_latencies = []
+    first_day = date.today() - timedelta(days=days - 1)
+    batch_size = 200
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        records = []
+        for student_id, name, dept in roster:
+            first = datetime.combine(day, datetime.min.time()) + timedelta(hours=9, seconds=int(rng.integers(0, 3600)))
+            records.append((student_id, name, dept, "", first, first + timedelta(minutes=90)))
+        for start in range(0, len(records), batch_size):
+            batch = records[start:start + batch_size]
+            seconds, ok = timed(backend.insert_attendance_batch, batch)
+            if not ok:
+                raise RuntimeError("Attendance batch write failed")
+            batch_latencies.append(seconds)
+    result['attendance_write'] = dict(summarize(batch_latencies, units=students * days), batch_size=batch_size,
+                                      rows=students * days)
+
+    # Reports
+    today = date.today()
+    latencies = [timed(backend.daily_report, today - timedelta(days=i % days))[0] for i in range(5)]
+    result['daily_report'] = summarize(latencies)
+    latencies = [timed(backend.range_report, first_day, today)[0] for _ in range(3)]
+    result['range_report'] = dict(summarize(latencies), days=days)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the attendance pipeline")
+    parser.add_argument('--sizes', default="100,1000,10000", help="comma-separated student counts")
+    parser.add_argument('--samples', type=int, default=2, help="face samples per student")
+    parser.add_argument('--probes', type=int, default=50, help="predict calls per size")
+    parser.add_argument('--frames', type=int, default=50, help="replayed frames for the detection and live stages")
+    parser.add_argument('--faces-per-frame', type=int, default=4)
+    parser.add_argument('--days', type=int, default=30, help="days of attendance written per size")
+    parser.add_argument('--student-images', help="replay crops from this StudentImages directory")
+    parser.add_argument('--backend', choices=('sqlite', 'mysql'), default='sqlite')
+    parser.add_argument('--recognizer', choices=('lbph', 'batch'), default='lbph',
+                        help="camera worker recognizer backend for the live stage")
+    parser.add_argument('--mysql-database', default='bubt_attendance_bench')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    backend = MySQLBackend(args.mysql_database) if args.backend == 'mysql' else SQLiteBackend()
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'cpus': os.cpu_count(),
+            'backend': backend.name,
+            'seed': args.seed,
+            'samples_per_student': args.samples,
+            'recognizer': args.recognizer
+        },
+        'results': {}
+    }
+
+    sample_faces = list(stored_faces(args.student_images, 8, 1) if args.student_images else synthetic_faces(rng, 8, 1))
+    print("Benchmarking detection...", file=sys.stderr)
+    sequence = replay_frames(rng, sample_faces, args.frames, args.faces_per_frame)
+    report['results']['detection'] = bench_detection(sequence)
+    for size in (int(value) for value in args.sizes.split(',')):
+        print(f"Benchmarking {size} students...", file=sys.stderr)
+        report['results'][str(size)] = bench_students(backend, rng, size, args.samples, args.probes,
+                                                      args.days, args.student_images, args.faces_per_frame,
+                                                      args.frames, args.recognizer)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"✓ Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
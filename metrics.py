@@ -0,0 +1,197 @@
+"""Counters, gauges and histograms rendered in the Prometheus text format.
+
+Recording a value is a dict lookup and a short lock, so these are safe to
+use on the per-frame path. Every metric lives in the process-wide
+REGISTRY; camera worker processes send a snapshot of their own metrics to
+the app, which renders them next to its own values under an extra label.
+"""
+import bisect
+import threading
+
+# Seconds: from a JPEG encode or cache hit up to a slow full-frame scan or database round trip
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class CounterValue:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class GaugeValue(CounterValue):
+    def set(self, value):
+        self.value = float(value)
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class HistogramValue:
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        # One slot per upper bound plus +Inf; cumulated only when rendering
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+class Metric:
+    """A named metric; each combination of label values gets its own child value"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            # Unlabelled metrics are exported as zero before their first update
+            self._children[()] = self._new_value()
+
+    def _new_value(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Child value for these label values, in labelnames order"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_value())
+        return child
+
+    def snapshot(self):
+        return {tuple(str(v) for v in values): child.snapshot()
+                for values, child in list(self._children.items())}
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _new_value(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def _new_value(self):
+        return GaugeValue()
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_value(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    """All metrics of this process, by name"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric, or return the one already registered under its name"""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def snapshot(self, names=None):
+        """Picklable {name: {label_values: value}} of every metric, or only those in names"""
+        return {name: metric.snapshot() for name, metric in list(self._metrics.items())
+                if names is None or name in names}
+
+    def render(self, sources=()):
+        """Prometheus text exposition of this process's metrics.
+
+        sources is a list of (labels, snapshot) pairs from other processes;
+        their samples are added to the metrics of the same name with the
+        given {label: value} pairs prepended.
+        """
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for extra, snapshot in [({}, self.snapshot())] + list(sources):
+                names = tuple(extra) + metric.labelnames
+                for values, value in sorted(snapshot.get(name, {}).items()):
+                    values = tuple(extra.values()) + values
+                    if metric.kind == 'histogram':
+                        counts, total = value
+                        cumulative = 0
+                        for bound, count in zip(metric.buckets + (float('inf'),), counts):
+                            cumulative += count
+                            labels = _format_labels(names + ('le',), values + (_format_number(bound),))
+                            lines.append(f"{name}_bucket{labels} {cumulative}")
+                        labels = _format_labels(names, values)
+                        lines.append(f"{name}_sum{labels} {_format_number(total)}")
+                        lines.append(f"{name}_count{labels} {cumulative}")
+                    else:
+                        lines.append(f"{name}{_format_labels(names, values)} {_format_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
@@ -0,0 +1,1122 @@
+"""Camera and face-processing pipeline shared by the Flask app.
+
+Nothing in here touches Flask or MySQL, so the same code can run inside
+request handlers, background threads or worker processes.
+"""
+import contextlib
+import math
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+import metrics
+
+# Hot-path metrics; camera worker processes send them to the app with their stats
+FRAME_READ_SECONDS = metrics.histogram('attendance_frame_read_seconds', "Time to read one frame from a camera")
+DETECT_SECONDS = metrics.histogram('attendance_detect_seconds', "Time spent in one detectMultiScale call")
+PREDICT_SECONDS = metrics.histogram('attendance_predict_seconds',
+                                    "Time spent in one recognizer predict call (per face, or per frame when batched)")
+ENCODE_SECONDS = metrics.histogram('attendance_encode_seconds', "Time to JPEG-encode one frame")
+FACES_PREDICTED = metrics.counter('attendance_faces_predicted_total',
+                                  "Fresh face predictions, by result (recognized or unknown)", ['result'])
+FRAMES_DROPPED = metrics.counter('attendance_frames_dropped_total',
+                                 "Frames skipped or discarded, by pipeline stage", ['stage'])
+# What a camera worker reports; anything else in its registry (e.g. app.py's metrics,
+# when the spawned worker re-imports the main module) belongs to the web process
+WORKER_METRICS = frozenset(metric.name for metric in (
+    FRAME_READ_SECONDS, DETECT_SECONDS, PREDICT_SECONDS, ENCODE_SECONDS, FACES_PREDICTED, FRAMES_DROPPED))
+
+
+class DropOldestQueue:
+    """Bounded queue that discards the oldest item instead of blocking the producer"""
+
+    def __init__(self, maxsize=2):
+        self._items = deque()
+        self.maxsize = maxsize
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        """Queue item; True if the oldest item was dropped to make room"""
+        with self._cond:
+            dropped = len(self._items) >= self.maxsize
+            if dropped:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+        return dropped
+
+    def get(self, timeout=None):
+        """Return the oldest item, or None on timeout / after close()"""
+        with self._cond:
+            if not self._items and not self._closed:
+                self._cond.wait(timeout)
+            if self._items:
+                return self._items.popleft()
+            return None
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class StageStats:
+    """Latency counters for one pipeline stage"""
+
+    def __init__(self, window=200):
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+            self._recent.append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            recent = sorted(self._recent)
+            count, total, max_seconds = self.count, self.total, self.max
+        p95 = recent[int(len(recent) * 0.95) - 1] if recent else 0.0
+        return {
+            'count': count,
+            'avg_ms': round(total / count * 1000, 2) if count else 0.0,
+            'p95_ms': round(p95 * 1000, 2),
+            'max_ms': round(max_seconds * 1000, 2)
+        }
+
+
+def box_iou(a, b):
+    """Intersection over union of two (x, y, w, h) boxes"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = min(ax + aw, bx + bw) - max(ax, bx)
+    ih = min(ay + ah, by + bh) - max(ay, by)
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    return inter / float(aw * ah + bw * bh - inter)
+
+
+def face_size_limits(frame_width, horizontal_fov=60.0, min_distance=0.5, max_distance=5.0,
+                     face_width=0.16):
+    """Expected face width in pixels for the nearest and farthest seat.
+
+    Uses a pinhole model: a face `face_width` metres wide at `distance`
+    metres spans face_width * focal_px / distance pixels.
+    """
+    focal_px = (frame_width / 2.0) / math.tan(math.radians(horizontal_fov) / 2.0)
+    smallest = int(face_width * focal_px / max_distance)
+    largest = int(face_width * focal_px / min_distance)
+    return (smallest, smallest), (largest, largest)
+
+
+class FaceDetector:
+    """Haar face detection with optional downscaling and ROI-limited search.
+
+    mode 'full' scans the whole frame at full resolution (the original
+    behaviour), 'downscale' scans a resized frame and maps boxes back, and
+    'roi' additionally searches only around the previous frame's faces,
+    falling back to a (downscaled) full scan every `full_scan_interval`
+    frames or whenever the ROIs come up empty.
+    """
+
+    CASCADE_WINDOW = 24
+
+    def __init__(self, cascade_path, mode='downscale', scale_factor=1.2, min_neighbors=5,
+                 min_size=(30, 30), max_size=None, downscale=0.5, roi_margin=0.5,
+                 full_scan_interval=15):
+        self.cascade_path = cascade_path
+        self.mode = mode
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = tuple(min_size)
+        self.max_size = tuple(max_size) if max_size else None
+        # Never shrink the smallest expected face below the cascade's 24px window
+        self.downscale = min(1.0, max(downscale, self.CASCADE_WINDOW / float(min(self.min_size))))
+        self.roi_margin = roi_margin
+        self.full_scan_interval = full_scan_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._previous = []
+        self._frames_since_full = 0
+        self.full_scans = 0
+        self.roi_scans = 0
+
+    def _cascade(self):
+        # CascadeClassifier is not safe to share across threads
+        cascade = getattr(self._local, 'cascade', None)
+        if cascade is None:
+            cascade = cv2.CascadeClassifier(self.cascade_path)
+            self._local.cascade = cascade
+        return cascade
+
+    def _scaled_size(self, size, scale):
+        if size is None:
+            return None
+        return (max(self.CASCADE_WINDOW, int(size[0] * scale)), max(self.CASCADE_WINDOW, int(size[1] * scale)))
+
+    def _detect(self, gray, scale):
+        """Run the cascade on gray resized by `scale`, returning boxes in gray's coordinates"""
+        if scale < 1.0:
+            small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            small, scale = gray, 1.0
+        kwargs = {'scaleFactor': self.scale_factor, 'minNeighbors': self.min_neighbors,
+                  'minSize': self._scaled_size(self.min_size, scale)}
+        if self.max_size:
+            kwargs['maxSize'] = self._scaled_size(self.max_size, scale)
+        started = time.perf_counter()
+        boxes = self._cascade().detectMultiScale(small, **kwargs)
+        DETECT_SECONDS.observe(time.perf_counter() - started)
+        return [tuple(int(round(v / scale)) for v in box) for box in boxes]
+
+    def _full_scan(self, gray):
+        self.full_scans += 1
+        scale = 1.0 if self.mode == 'full' else self.downscale
+        return self._detect(gray, scale)
+
+    def _roi_scan(self, gray, previous):
+        self.roi_scans += 1
+        height, width = gray.shape[:2]
+        found = []
+        for (x, y, w, h) in previous:
+            mx, my = int(w * self.roi_margin), int(h * self.roi_margin)
+            x0, y0 = max(0, x - mx), max(0, y - my)
+            x1, y1 = min(width, x + w + mx), min(height, y + h + my)
+            for (fx, fy, fw, fh) in self._detect(gray[y0:y1, x0:x1], self.downscale):
+                box = (fx + x0, fy + y0, fw, fh)
+                # Neighbouring ROIs can overlap and find the same face twice
+                if all(box_iou(box, other) < 0.5 for other in found):
+                    found.append(box)
+        return found
+
+    def detect(self, gray):
+        """Return face boxes (x, y, w, h) in full-frame coordinates"""
+        with self._lock:
+            previous = list(self._previous)
+            self._frames_since_full += 1
+            use_roi = (self.mode == 'roi' and previous
+                       and self._frames_since_full < self.full_scan_interval)
+            if not use_roi:
+                self._frames_since_full = 0
+
+        faces = self._roi_scan(gray, previous) if use_roi else []
+        rescanned = not faces
+        if rescanned:
+            faces = self._full_scan(gray)
+
+        with self._lock:
+            self._previous = faces
+            if rescanned:
+                self._frames_since_full = 0
+        return faces
+
+    def get_stats(self):
+        return {
+            'mode': self.mode,
+            'downscale': round(self.downscale, 3),
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+            'full_scans': self.full_scans,
+            'roi_scans': self.roi_scans
+        }
+
+
+class Track:
+    """A face followed across frames, with its last recognition result"""
+
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = box
+        self.label = None
+        self.confidence = None
+        self.frames_since_predict = 0
+        self.missed = 0
+
+
+class FaceTracker:
+    """Associates detections across frames so identities can be reused.
+
+    A track is re-predicted when it is new, every `repredict_interval`
+    frames, or once its cached distance, grown by `confidence_decay` per
+    reused frame, crosses `confidence_limit` (so borderline matches are
+    re-checked sooner than confident ones).
+    """
+
+    def __init__(self, iou_threshold=0.3, centroid_ratio=0.5, max_missed=5,
+                 repredict_interval=10, confidence_decay=1.0, confidence_limit=60):
+        self.iou_threshold = iou_threshold
+        self.centroid_ratio = centroid_ratio
+        self.max_missed = max_missed
+        self.repredict_interval = repredict_interval
+        self.confidence_decay = confidence_decay
+        self.confidence_limit = confidence_limit
+        self._tracks = []
+        self._next_id = 1
+        self._model_key = None
+        self._lock = threading.Lock()
+        self.predictions = 0
+        self.reused = 0
+
+    def _match_score(self, track, box):
+        iou = box_iou(track.box, box)
+        if iou >= self.iou_threshold:
+            return iou
+        # Fast movers can lose overlap; fall back to centroid distance
+        tx, ty, tw, th = track.box
+        bx, by, bw, bh = box
+        dx = (tx + tw / 2.0) - (bx + bw / 2.0)
+        dy = (ty + th / 2.0) - (by + bh / 2.0)
+        limit = self.centroid_ratio * max(tw, th, bw, bh)
+        if (dx * dx + dy * dy) ** 0.5 <= limit:
+            return self.iou_threshold * 0.5
+        return 0.0
+
+    def update(self, boxes, model_key=None):
+        """Match this frame's boxes to tracks; returns one Track per box, in order"""
+        with self._lock:
+            if model_key != self._model_key:
+                # A different model means cached labels are meaningless
+                self._tracks = []
+                self._model_key = model_key
+
+            pairs = []
+            for t_idx, track in enumerate(self._tracks):
+                for b_idx, box in enumerate(boxes):
+                    score = self._match_score(track, box)
+                    if score > 0:
+                        pairs.append((score, t_idx, b_idx))
+            pairs.sort(reverse=True)
+
+            assigned = [None] * len(boxes)
+            used_tracks = set()
+            for score, t_idx, b_idx in pairs:
+                if t_idx in used_tracks or assigned[b_idx] is not None:
+                    continue
+                track = self._tracks[t_idx]
+                track.box = tuple(int(v) for v in boxes[b_idx])
+                track.missed = 0
+                track.frames_since_predict += 1
+                assigned[b_idx] = track
+                used_tracks.add(t_idx)
+
+            for t_idx, track in enumerate(self._tracks):
+                if t_idx not in used_tracks:
+                    track.missed += 1
+            self._tracks = [t for t in self._tracks if t.missed <= self.max_missed]
+
+            for b_idx, box in enumerate(boxes):
+                if assigned[b_idx] is None:
+                    track = Track(self._next_id, tuple(int(v) for v in box))
+                    self._next_id += 1
+                    self._tracks.append(track)
+                    assigned[b_idx] = track
+            return assigned
+
+    def needs_prediction(self, track):
+        if track.label is None or track.frames_since_predict >= self.repredict_interval:
+            return True
+        decayed = track.confidence + self.confidence_decay * track.frames_since_predict
+        return decayed >= self.confidence_limit and track.confidence < self.confidence_limit
+
+    def set_prediction(self, track, label, confidence):
+        with self._lock:
+            track.label = label
+            track.confidence = confidence
+            track.frames_since_predict = 0
+            self.predictions += 1
+
+    def reuse(self, track):
+        """Count a frame served from the track's cached identity"""
+        with self._lock:
+            self.reused += 1
+            return track.label, track.confidence
+
+    def get_stats(self):
+        total = self.predictions + self.reused
+        return {
+            'active_tracks': len(self._tracks),
+            'predictions': self.predictions,
+            'reused': self.reused,
+            'reuse_ratio': round(self.reused / total, 3) if total else 0.0
+        }
+
+
+# LBPH distances: below MATCH_DISTANCE a face is taken as the predicted
+# student, above UNKNOWN_DISTANCE it is treated as a stranger
+MATCH_DISTANCE = 60
+UNKNOWN_DISTANCE = 80
+
+
+def lbp_histogram(gray, radius=1, neighbors=8, grid_x=8, grid_y=8):
+    """Spatial histogram of circular LBP codes, computed exactly as OpenCV's LBPH does.
+
+    Returns a float32 vector of grid_x * grid_y cells of 2**neighbors bins,
+    each cell normalized by its pixel count.
+    """
+    src = gray.astype(np.float32)
+    rows, cols = gray.shape[:2]
+    center = src[radius:rows - radius, radius:cols - radius]
+    codes = np.zeros(center.shape, dtype=np.int32)
+    epsilon = np.finfo(np.float32).eps
+    for n in range(neighbors):
+        # Same single-precision sample point and bilinear weights as cv::face::elbp
+        x = np.float32(radius * math.cos(2.0 * math.pi * n / neighbors))
+        y = np.float32(-radius * math.sin(2.0 * math.pi * n / neighbors))
+        fx, fy, cx, cy = int(math.floor(x)), int(math.floor(y)), int(math.ceil(x)), int(math.ceil(y))
+        tx, ty = np.float32(x - fx), np.float32(y - fy)
+        one = np.float32(1)
+        w1, w2, w3, w4 = (one - tx) * (one - ty), tx * (one - ty), (one - tx) * ty, tx * ty
+
+        def at(dy, dx):
+            return src[radius + dy:rows - radius + dy, radius + dx:cols - radius + dx]
+        t = w1 * at(fy, fx) + w2 * at(fy, cx) + w3 * at(cy, fx) + w4 * at(cy, cx)
+        codes += ((t > center) | (np.abs(t - center) < epsilon)).astype(np.int32) << n
+
+    bins = 1 << neighbors
+    height, width = codes.shape[0] // grid_y, codes.shape[1] // grid_x
+    cells = codes[:grid_y * height, :grid_x * width].reshape(grid_y, height, grid_x, width)
+    cells = cells.transpose(0, 2, 1, 3).reshape(grid_y * grid_x, height * width)
+    cells = cells + (np.arange(grid_y * grid_x, dtype=np.int32) * bins)[:, None]
+    counts = np.bincount(cells.ravel(), minlength=grid_y * grid_x * bins)
+    return (counts / float(height * width)).astype(np.float32)
+
+
+class BatchLBPHMatcher:
+    """LBPH recognizer that matches all of a frame's faces in one NumPy pass.
+
+    Holds the training histograms of an OpenCV LBPH model as one
+    contiguous matrix (bins x samples) and returns the same (label,
+    chi-square distance) as LBPHFaceRecognizer.predict. Bins that are
+    empty in every query face only add the sample's own mass to the
+    distance, so only the query faces' occupied bins are read; small face
+    crops occupy few bins.
+    """
+
+    def __init__(self, histograms, labels, radius=1, neighbors=8, grid_x=8, grid_y=8,
+                 threshold=float('inf'), chunk_elements=1 << 20):
+        self.radius = radius
+        self.neighbors = neighbors
+        self.grid_x = grid_x
+        self.grid_y = grid_y
+        self.threshold = threshold
+        self.chunk_elements = chunk_elements
+        # Bins x samples, so gathering the occupied bins reads contiguous rows
+        self._histograms = np.ascontiguousarray(np.asarray(histograms, dtype=np.float32).T)
+        self._labels = np.asarray(labels, dtype=np.int32).ravel()
+        self._mass = self._histograms.sum(axis=0, dtype=np.float64)
+
+    @classmethod
+    def from_lbph(cls, model, **kwargs):
+        """Copy the histograms and parameters out of a trained cv2.face LBPHFaceRecognizer"""
+        histograms = model.getHistograms()
+        matrix = np.empty((len(histograms), histograms[0].size if histograms else 0), dtype=np.float32)
+        for row, histogram in enumerate(histograms):
+            matrix[row] = histogram.ravel()
+        del histograms
+        return cls(matrix, model.getLabels(), radius=model.getRadius(), neighbors=model.getNeighbors(),
+                   grid_x=model.getGridX(), grid_y=model.getGridY(),
+                   threshold=min(model.getThreshold(), float('inf')), **kwargs)
+
+    @property
+    def samples(self):
+        return self._labels.size
+
+    def histogram(self, face):
+        return lbp_histogram(face, self.radius, self.neighbors, self.grid_x, self.grid_y)
+
+    def predict_batch(self, faces):
+        """(label, distance) for each face crop; (-1, inf) when nothing is under the threshold"""
+        if not faces:
+            return []
+        if not self.samples:
+            return [(-1, float('inf'))] * len(faces)
+        queries = np.stack([self.histogram(face) for face in faces])
+        occupied = np.flatnonzero(queries.any(axis=0))
+        queries = queries[:, occupied][:, :, None]
+        best = np.full(len(faces), np.inf)
+        best_index = np.zeros(len(faces), dtype=np.int64)
+        chunk = max(1, self.chunk_elements // (len(faces) * max(1, occupied.size)))
+        for start in range(0, self.samples, chunk):
+            stored = self._histograms[occupied, start:start + chunk]
+            diff = stored[None] - queries
+            total = stored[None] + queries
+            np.square(diff, out=diff)
+            # Both sides empty: OpenCV skips the bin, 0/0 here would be NaN
+            np.divide(diff, total, out=diff, where=total > 0)
+            # Chi-square (alternative form) = 2 * sum((a - b)^2 / (a + b))
+            distances = 2.0 * (self._mass[start:start + chunk] - stored.sum(axis=0, dtype=np.float64)
+                               + diff.sum(axis=1, dtype=np.float64))
+            index = distances.argmin(axis=1)
+            nearest = distances[np.arange(len(faces)), index]
+            better = nearest < best
+            best[better] = nearest[better]
+            best_index[better] = index[better] + start
+        return [(int(self._labels[i]), float(d)) if d < self.threshold else (-1, float('inf'))
+                for i, d in zip(best_index, best)]
+
+    def predict(self, face):
+        return self.predict_batch([face])[0]
+
+
+def identify_faces(gray, boxes, model, tracker=None, model_key=None, in_order=None):
+    """Predict (label, distance) for every box, reusing tracked identities.
+
+    Models with predict_batch (BatchLBPHMatcher) get all of the frame's
+    faces in one call. Returns a list of (track_id, label, distance, fresh)
+    in box order; track_id is None when no tracker is given and fresh is
+    False for an identity reused from the track. Only the tracker step runs
+    inside the `in_order` context manager, so parallel frames reach the
+    tracker in camera order but still predict in parallel.
+    """
+    with in_order if in_order is not None else contextlib.nullcontext():
+        if tracker is not None:
+            tracks = tracker.update(boxes, model_key=model_key)
+            # Read now: another frame may update these tracks once the section ends
+            reused = {i: tracker.reuse(track) for i, track in enumerate(tracks)
+                      if not tracker.needs_prediction(track)}
+        else:
+            tracks, reused = [None] * len(boxes), {}
+    pending = [i for i in range(len(boxes)) if i not in reused]
+    crops = [gray[y:y+h, x:x+w] for (x, y, w, h) in (boxes[i] for i in pending)]
+    if hasattr(model, 'predict_batch'):
+        started = time.perf_counter()
+        predictions = model.predict_batch(crops)
+        if crops:
+            PREDICT_SECONDS.observe(time.perf_counter() - started)
+    else:
+        predictions = []
+        for crop in crops:
+            started = time.perf_counter()
+            predictions.append(model.predict(crop))
+            PREDICT_SECONDS.observe(time.perf_counter() - started)
+    predicted = dict(zip(pending, predictions))
+
+    results = []
+    for i, track in enumerate(tracks):
+        track_id = track.track_id if track is not None else None
+        if i in reused:
+            results.append((track_id,) + reused[i] + (False,))
+            continue
+        label, distance = predicted[i]
+        if track is not None:
+            tracker.set_prediction(track, label, distance)
+        results.append((track_id, label, distance, True))
+    return results
+
+
+class SampleSelector:
+    """Keeps only face samples that differ enough from the ones already kept.
+
+    Each candidate is shrunk to a small, contrast-normalised thumbnail and
+    compared (mean absolute pixel difference, 0-255) against every kept
+    sample; near-duplicates of consecutive frames are rejected. If nothing
+    new is accepted for `stall_frames` candidates the threshold is relaxed,
+    so a student who keeps very still still reaches the target.
+    """
+
+    def __init__(self, target_samples=100, min_difference=8.0, thumbnail_size=24,
+                 stall_frames=30, relax_factor=0.8):
+        self.target_samples = target_samples
+        self.min_difference = min_difference
+        self.thumbnail_size = thumbnail_size
+        self.stall_frames = stall_frames
+        self.relax_factor = relax_factor
+        self.threshold = min_difference
+        self._thumbnails = np.empty((target_samples, thumbnail_size * thumbnail_size), dtype=np.float32)
+        self.kept = 0
+        self.rejected = 0
+        self._since_accept = 0
+
+    @property
+    def complete(self):
+        return self.kept >= self.target_samples
+
+    def _thumbnail(self, face):
+        small = cv2.resize(face, (self.thumbnail_size, self.thumbnail_size), interpolation=cv2.INTER_AREA)
+        return cv2.equalizeHist(small).astype(np.float32).ravel()
+
+    def offer(self, face):
+        """Return True if the face should be kept as a training sample"""
+        if self.complete:
+            return False
+        thumb = self._thumbnail(face)
+        if self.kept:
+            distances = np.abs(self._thumbnails[:self.kept] - thumb).mean(axis=1)
+            if distances.min() < self.threshold:
+                self.rejected += 1
+                self._since_accept += 1
+                if self._since_accept >= self.stall_frames:
+                    self.threshold *= self.relax_factor
+                    self._since_accept = 0
+                return False
+        self._thumbnails[self.kept] = thumb
+        self.kept += 1
+        self._since_accept = 0
+        return True
+
+
+class CameraSource:
+    """Owns one VideoCapture and keeps only its latest frame for any number of readers.
+
+    camera_index may also be a video file path, which is played back at its
+    own frame rate and looped, standing in for a live camera.
+    Frames handed out are shared between readers: copy before drawing on them.
+    """
+
+    def __init__(self, camera_index, width=640, height=480):
+        self.camera_index = camera_index
+        self.width = width
+        self.height = height
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._closed = False
+        self._camera = None
+        self._thread = None
+        self.stats = StageStats()
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self.started_at is not None and not self._closed
+
+    @property
+    def is_file(self):
+        return isinstance(self.camera_index, str)
+
+    def open(self):
+        """Open the device and start the capture thread; False if unavailable"""
+        self._camera = cv2.VideoCapture(self.camera_index)
+        if not self._camera.isOpened():
+            print(f"Error: Could not open camera {self.camera_index}")
+            self._camera.release()
+            self._closed = True
+            return False
+        if not self.is_file:
+            self._camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+            self._camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._capture_loop,
+                                        name=f"camera{self.camera_index}-capture", daemon=True)
+        self._thread.start()
+        return True
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        if self._camera is not None:
+            self._camera.release()
+            self._camera = None
+
+    def _capture_loop(self):
+        # Files are paced to their frame rate; a live camera paces itself
+        interval = 1.0 / (self._camera.get(cv2.CAP_PROP_FPS) or 25.0) if self.is_file else 0.0
+        next_due = time.perf_counter()
+        rewound = False
+        while not self._closed:
+            started = time.perf_counter()
+            success, frame = self._camera.read()
+            if not success:
+                if self.is_file and not rewound:
+                    self._camera.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    rewound = True
+                    continue
+                print(f"Failed to read frame from camera {self.camera_index}")
+                break
+            rewound = False
+            elapsed = time.perf_counter() - started
+            self.stats.record(elapsed)
+            FRAME_READ_SECONDS.observe(elapsed)
+            with self._cond:
+                self._frame = frame
+                self._seq += 1
+                self._cond.notify_all()
+            if interval:
+                next_due += interval
+                time.sleep(max(0.0, next_due - time.perf_counter()))
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def read(self, after_seq=0, timeout=1.0):
+        """Wait for a frame newer than after_seq; (None, None) once closed"""
+        with self._cond:
+            if self._seq <= after_seq and not self._closed:
+                self._cond.wait_for(lambda: self._seq > after_seq or self._closed, timeout)
+            if self._seq > after_seq:
+                return self._seq, self._frame
+            if self._closed:
+                return None, None
+            return after_seq, None
+
+    def get_stats(self):
+        elapsed = time.time() - self.started_at if self.started_at else 0.0
+        return {
+            'camera_index': self.camera_index,
+            'running': self.running,
+            'frames_captured': self._seq,
+            'capture_fps': round(self._seq / elapsed, 2) if elapsed else 0.0,
+            'capture': self.stats.snapshot()
+        }
+
+
+class CameraRegistry:
+    """One shared CameraSource per device, reference counted by its users"""
+
+    def __init__(self, width=640, height=480):
+        self.width = width
+        self.height = height
+        self._sources = {}
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, camera_index):
+        """Return a running source for camera_index, or None if it can't be opened"""
+        with self._lock:
+            source = self._sources.get(camera_index)
+            if source is None or not source.running:
+                source = CameraSource(camera_index, self.width, self.height)
+                if not source.open():
+                    return None
+                self._sources[camera_index] = source
+                self._users[camera_index] = 0
+            self._users[camera_index] += 1
+            return source
+
+    def release(self, source):
+        with self._lock:
+            index = source.camera_index
+            if self._sources.get(index) is not source:
+                source.close()
+                return
+            self._users[index] -= 1
+            if self._users[index] <= 0:
+                del self._sources[index]
+                del self._users[index]
+                source.close()
+
+    def get_stats(self):
+        with self._lock:
+            return {index: dict(source.get_stats(), users=self._users[index])
+                    for index, source in self._sources.items()}
+
+
+class FrameBroadcaster:
+    """Fans the latest encoded frame out to any number of subscribers.
+
+    Only one frame is held; subscribers that fall behind skip to the newest
+    frame instead of queueing, so memory stays flat however slow a viewer is.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._closed = False
+        self.subscribers = 0
+        self.skipped = 0
+
+    def publish(self, frame):
+        with self._cond:
+            self._frame = frame
+            self._seq += 1
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def subscribe(self, timeout=1.0):
+        """Yield frames as they are published until the broadcaster closes"""
+        with self._cond:
+            self.subscribers += 1
+            last_seq = self._seq
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._seq > last_seq or self._closed, timeout)
+                    if self._seq == last_seq:
+                        if self._closed:
+                            return
+                        continue
+                    if self._seq - last_seq > 1:
+                        self.skipped += self._seq - last_seq - 1
+                        FRAMES_DROPPED.labels('viewer').inc(self._seq - last_seq - 1)
+                    last_seq, frame = self._seq, self._frame
+                yield frame
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+
+class FrameOrder:
+    """Lets one section of parallel frame processing run strictly in the order frames were read.
+
+    Each frame gets a ticket; section(ticket) waits until every earlier
+    ticket has finished (or the wait times out, so a stuck frame can't stall
+    the camera), and finish(ticket) must be called for every ticket.
+    """
+
+    def __init__(self, timeout=2.0):
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._next = 0
+        self._done = set()
+
+    @contextlib.contextmanager
+    def section(self, ticket):
+        with self._cond:
+            self._cond.wait_for(lambda: self._next >= ticket, self.timeout)
+        try:
+            yield
+        finally:
+            self.finish(ticket)
+
+    def finish(self, ticket):
+        with self._cond:
+            if ticket >= self._next:
+                self._done.add(ticket)
+                while self._next in self._done:
+                    self._done.discard(self._next)
+                    self._next += 1
+                self._cond.notify_all()
+
+
+class FramePipeline:
+    """Recognition and encoding stages on top of a shared CameraSource.
+
+    `workers` threads pull the newest camera frame and run
+    `process_frame(frame, in_order) -> frame` (OpenCV releases the GIL, so
+    several workers use several cores as long as process_frame is thread
+    safe). `in_order` is a context manager whose body runs in the order the
+    frames were read, for per-frame state such as a face tracker. The
+    encoder turns results into JPEG bytes and publishes them to a
+    FrameBroadcaster. Camera frames that arrive while every worker is busy
+    are skipped and counted rather than queued.
+    """
+
+    def __init__(self, source, process_frame, workers=1, queue_size=2, jpeg_quality=80):
+        self.source = source
+        self.process_frame = process_frame
+        self.workers = workers
+        self.jpeg_quality = jpeg_quality
+        self.broadcaster = FrameBroadcaster()
+        self._encode_queue = DropOldestQueue(queue_size)
+        self._stop = threading.Event()
+        self._threads = []
+        self._read_lock = threading.Lock()
+        self._last_read_seq = 0
+        self._tickets = 0
+        self._order = FrameOrder()
+        self._last_encoded_seq = -1
+        self.stage_stats = {
+            'process': StageStats(),
+            'encode': StageStats()
+        }
+        self.frames_processed = 0
+        self.camera_dropped = 0
+        self.out_of_order_dropped = 0
+        self.viewers = 0
+
+    @property
+    def running(self):
+        return bool(self._threads) and not self._stop.is_set() and self.source.running
+
+    def start(self):
+        targets = [("encode", self._encode_loop)]
+        targets += [(f"process-{i}", self._process_loop) for i in range(self.workers)]
+        for name, target in targets:
+            thread = threading.Thread(target=target, name=f"camera{self.source.camera_index}-{name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._encode_queue.close()
+        self.broadcaster.close()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=2)
+
+    def _next_frame(self):
+        """Hand each camera frame to at most one worker, with its FrameOrder ticket"""
+        with self._read_lock:
+            seq, frame = self.source.read(self._last_read_seq, timeout=0.5)
+            if seq is None:
+                self._stop.set()
+                return None, None, None
+            if frame is None:
+                return None, None, None
+            if seq - self._last_read_seq > 1:
+                self.camera_dropped += seq - self._last_read_seq - 1
+                FRAMES_DROPPED.labels('before_process').inc(seq - self._last_read_seq - 1)
+            self._last_read_seq = seq
+            ticket = self._tickets
+            self._tickets += 1
+            return seq, ticket, frame
+
+    def _process_loop(self):
+        while not self._stop.is_set():
+            seq, ticket, frame = self._next_frame()
+            if frame is None:
+                continue
+            started = time.perf_counter()
+            try:
+                frame = self.process_frame(frame.copy(), self._order.section(ticket))
+            except Exception as e:
+                print(f"Error processing frame: {e}")
+                continue
+            finally:
+                # Also when process_frame failed or never entered the section
+                self._order.finish(ticket)
+            self.stage_stats['process'].record(time.perf_counter() - started)
+            self.frames_processed += 1
+            if self._encode_queue.put((seq, frame)):
+                FRAMES_DROPPED.labels('before_encode').inc()
+        self._encode_queue.close()
+        self.broadcaster.close()
+
+    def _encode_loop(self):
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality]
+        while not self._stop.is_set():
+            item = self._encode_queue.get(timeout=0.5)
+            if item is None:
+                continue
+            seq, frame = item
+            if self.broadcaster.subscribers == 0:
+                # Nobody is watching; recognition still runs, encoding would be wasted
+                continue
+            # Parallel workers can finish out of order; never step backwards in time
+            if seq <= self._last_encoded_seq:
+                self.out_of_order_dropped += 1
+                FRAMES_DROPPED.labels('out_of_order').inc()
+                continue
+            started = time.perf_counter()
+            ret, buffer = cv2.imencode('.jpg', frame, params)
+            if not ret:
+                continue
+            elapsed = time.perf_counter() - started
+            self.stage_stats['encode'].record(elapsed)
+            ENCODE_SECONDS.observe(elapsed)
+            self._last_encoded_seq = seq
+            self.broadcaster.publish(buffer.tobytes())
+
+    def get_stats(self):
+        stats = self.source.get_stats()
+        stats['stages'] = {'capture': stats.pop('capture')}
+        stats['stages'].update({name: s.snapshot() for name, s in self.stage_stats.items()})
+        stats.update({
+            'running': self.running,
+            'workers': self.workers,
+            'frames_processed': self.frames_processed,
+            'viewers': self.broadcaster.subscribers,
+            'dropped': {
+                'before_process': self.camera_dropped,
+                'before_encode': self._encode_queue.dropped,
+                'out_of_order': self.out_of_order_dropped,
+                'viewer_skipped': self.broadcaster.skipped
+            }
+        })
+        return stats
+
+
+class RecognitionLoop:
+    """Per-frame detection, recognition and drawing for one camera.
+
+    Used as a FramePipeline's process_frame. Recognized students and
+    unknown faces are passed to report(kind, *payload):
+    ('seen', [(student_id, name, department, timestamp), ...]) and
+    ('unknown', track_key, face_crop). backend 'batch' wraps the loaded
+    model in a BatchLBPHMatcher.
+    """
+
+    def __init__(self, detector, tracker, title, report, backend='lbph'):
+        self.detector = detector
+        self.tracker = tracker
+        self.title = title
+        self.report = report
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._model = None
+        self._model_path = None
+        self._names = {}
+
+    def set_model(self, model_path, names):
+        """Switch to the model saved at model_path (None for no model) and its label -> student map.
+
+        Each model is saved under its own path, so the file is only read when
+        the path changes. If it can't be read, recognition pauses rather than
+        pairing names with the wrong model.
+        """
+        if model_path == self._model_path:
+            with self._lock:
+                self._names = names
+            return
+        model = None
+        if model_path is not None:
+            try:
+                model = cv2.face.LBPHFaceRecognizer_create()
+                model.read(model_path)
+            except cv2.error as e:
+                print(f"Could not load model {model_path}: {e}")
+                model, model_path = None, None
+        self.use_model(model, names, model_path)
+
+    def use_model(self, model, names, model_path=None):
+        """Switch to an already loaded LBPH model (None for no model) and its label -> student map"""
+        if model is not None and self.backend == 'batch':
+            model = BatchLBPHMatcher.from_lbph(model)
+        with self._lock:
+            self._model, self._model_path, self._names = model, model_path, names
+
+    def __call__(self, frame, in_order=None):
+        # Read the model once so a reload mid-frame can't mix two models
+        with self._lock:
+            model, names = self._model, self._names
+        
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        faces_detected = self.detector.detect(gray)
+        # Tracked faces reuse their last identity until the tracker asks for a re-check.
+        # Detection and prediction run in parallel; the tracker must see frames in camera order
+        identities = identify_faces(gray, faces_detected, model, self.tracker, model_key=id(model),
+                                    in_order=in_order) if model else None
+        seen = []
+        now = time.time()
+        
+        for idx, (x, y, w, h) in enumerate(faces_detected):
+            cv2.rectangle(frame, (x, y), (x+w, y+h), (46, 125, 50), 3)
+            if not model:
+                continue
+            track_id, label_id, conf, fresh = identities[idx]
+            confidence_percent = round(100 - conf)
+            recognized = conf < MATCH_DISTANCE and label_id in names
+            if fresh:
+                FACES_PREDICTED.labels('recognized' if recognized else 'unknown').inc()
+            
+            if recognized:
+                student_id, name, department = names[label_id]
+                seen.append((student_id, name, department, now))
+                display_text = f"{name}"
+                display_text2 = f"ID: {student_id} | {department}"
+                color = (46, 125, 50)
+            else:
+                display_text = "Unknown Person"
+                display_text2 = "Not Registered"
+                color = (244, 67, 54)
+                # Only on a fresh prediction, so a stranger isn't sent every frame
+                if conf > UNKNOWN_DISTANCE and fresh:
+                    track_key = track_id if track_id is not None else (x // 80, y // 80)
+                    self.report('unknown', track_key, frame[y:y+h, x:x+w].copy())
+            
+            cv2.putText(frame, display_text, (x+5, y-30),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
+            cv2.putText(frame, display_text2, (x+5, y-10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+            cv2.putText(frame, f"Confidence: {confidence_percent}%", (x+5, y+h+25),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2)
+        
+        if seen:
+            self.report('seen', seen)
+        cv2.putText(frame, self.title, (10, 30),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+        return frame
+
+
+def forward_frames(pipeline, frames, viewers):
+    """Copy encoded frames to the parent process while it has viewers, dropping stale ones"""
+    while pipeline.running:
+        if viewers.value <= 0:
+            time.sleep(0.2)
+            continue
+        for jpeg in pipeline.broadcaster.subscribe():
+            try:
+                frames.put_nowait(jpeg)
+            except queue.Full:
+                FRAMES_DROPPED.labels('forward').inc()
+                try:
+                    frames.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    frames.put_nowait(jpeg)
+                except queue.Full:
+                    pass
+            if viewers.value <= 0:
+                break
+
+
+def run_camera_worker(camera_id, source, settings, control, results, frames, viewers):
+    """Entry point of a camera's worker process.
+
+    Runs capture, detection and recognition for one camera on a
+    FramePipeline in this process. Results go to the shared `results`
+    queue as (kind, camera_id, ...) tuples, JPEG frames to `frames` while
+    `viewers.value` > 0. `control` takes ('model', model_path, names) and
+    ('stop',).
+    """
+    cv2.setNumThreads(settings.get('opencv_threads', 1))
+    
+    def report(kind, *payload):
+        results.put((kind, camera_id) + payload)
+    
+    camera = CameraSource(source, settings['width'], settings['height'])
+    if not camera.open():
+        report('error', f"Could not open camera {source}")
+        return
+    
+    min_size, max_size = face_size_limits(**settings['camera_setup'])
+    detector = FaceDetector(settings['cascade_path'], min_size=min_size, max_size=max_size,
+                            **settings['detection'])
+    tracker = FaceTracker(**settings['tracker'])
+    recognition = RecognitionLoop(detector, tracker, settings['title'], report,
+                                  backend=settings.get('recognizer_backend', 'lbph'))
+    recognition.set_model(settings['model_path'], settings['names'])
+    
+    pipeline = FramePipeline(camera, recognition, workers=settings['workers'],
+                             queue_size=settings['queue_size'], jpeg_quality=settings['jpeg_quality'])
+    pipeline.start()
+    threading.Thread(target=forward_frames, args=(pipeline, frames, viewers),
+                     name=f"{camera_id}-forward", daemon=True).start()
+    
+    next_stats = 0.0
+    try:
+        while pipeline.running:
+            try:
+                message = control.get(timeout=1.0)
+            except queue.Empty:
+                message = None
+            if message is not None:
+                if message[0] == 'stop':
+                    break
+                if message[0] == 'model':
+                    recognition.set_model(message[1], message[2])
+            if time.monotonic() >= next_stats:
+                report('stats', dict(pipeline.get_stats(),
+                                     detection=detector.get_stats(),
+                                     tracking=tracker.get_stats()))
+                report('metrics', metrics.REGISTRY.snapshot(names=WORKER_METRICS))
+                next_stats = time.monotonic() + settings.get('stats_interval', 2.0)
+    finally:
+        pipeline.stop()
+        camera.close()
+        report('stopped')